@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Single event loop asyncio HTTP server for the Bottle app.
+
+Threaded WSGI servers tie up a thread per open connection, which doesn't
+scale to thousands of long-lived push clients. This server runs everything
+from one asyncio event loop:
+
+  * Ordinary requests (/getstate, /setstepsize, the static routes, ...) are
+    passed to the unmodified Bottle app through a minimal inline WSGI
+    adapter. Those handlers run synchronously on the loop, so nothing else
+    is served while one runs. They are short, /getstate mostly writes a
+    pre-encoded snapshot, but they are not non-blocking: one may wait on
+    the state lock while the ticker thread publishes a tick.
+  * Push streams (/stream) are handled natively. A connection costs one
+    parked coroutine and a transport. On each publish, the Broadcaster
+    wakes the loop once, and the loop writes the same frame bytes to every
+    subscribed transport.
+
+Use it from server.py with --server asyncio. It is registered with Bottle
+under that name, so bottle.run(app, server='asyncio') works. server.py
+doesn't use Bottle's reloader; its source watcher, see watchSources(),
+runs in its own thread and works with this server as with the others.
+
+Only the HTTP/1.x features the app needs are implemented: keep-alive,
+Content-Length bodies, no chunked request bodies, no TLS. For 10k
+connections raise the open file limit, e.g. ulimit -n 20000.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import io
+import sys
+import time
+import asyncio
+import urllib.parse
+import bottle
+
+## Close a stream subscriber whose unsent output exceeds this many bytes.
+max_stream_buffer = 4 * 1024 * 1024
+## Seconds between SSE keepalive comments on idle streams.
+keepalive_interval = 15
+
+STREAM_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+                  b"Content-Type: text/event-stream\r\n"
+                  b"Cache-Control: no-cache\r\n"
+                  b"Connection: keep-alive\r\n\r\n"
+                  b"retry: 2000\n\n")
+
+class AsyncHTTPServer:
+    """
+    Serves app, a WSGI callable, plus push streams. streams maps a URL path
+    to a broadcast.Broadcaster whose payloads are sent to every client
+    connected to that path. Pass sock to accept on an already listening
+    socket instead of binding host and port.
+    """
+    def __init__(self, app, host, port, streams=None, quiet=False, sock=None):
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.quiet = quiet
+        self.streams = dict(streams or {})
+        ## path -> set of transports of connected stream clients
+        self.subscribers = {path:set() for path in self.streams}
+        self.loop = None
+
+    def run(self):
+        """ Serve until interrupted. """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        for path, broadcaster in self.streams.items():
+            broadcaster.addListener(self._listener(path))
+        if self.sock is not None:
+            ## Already listening, e.g. shared by mpserve.py workers.
+            listen = asyncio.start_server(self.handle, sock=self.sock)
+        else:
+            listen = asyncio.start_server(self.handle, self.host, self.port,
+                                          backlog=4096)
+        server = self.loop.run_until_complete(listen)
+        self.loop.create_task(self.keepalive())
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+            self.loop.close()
+
+    def _listener(self, path):
+        """ Return a thread-safe callback scheduling fanout(path). """
+        def notify():
+            self.loop.call_soon_threadsafe(self.fanout, path)
+        return notify
+
+    def fanout(self, path):
+        """ Write the latest payload for path to all its subscribers. """
+        payload = self.streams[path].payload
+        self.writeAll(path, payload)
+
+    def writeAll(self, path, data):
+        for transport in list(self.subscribers[path]):
+            if transport.is_closing():
+                self.subscribers[path].discard(transport)
+            elif transport.get_write_buffer_size() > max_stream_buffer:
+                ## Too slow to keep up; drop it. EventSource reconnects.
+                transport.abort()
+                self.subscribers[path].discard(transport)
+            else:
+                transport.write(data)
+
+    async def keepalive(self):
+        """ Send SSE comments so proxies don't time out idle streams. """
+        while True:
+            await asyncio.sleep(keepalive_interval)
+            for path in self.subscribers:
+                self.writeAll(path, b": keepalive\n\n")
+
+    async def handle(self, reader, writer):
+        """ Serve one connection, possibly several requests with keep-alive. """
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                method, target, version, headers = parseHead(head)
+                path, _, query = target.partition('?')
+                if method == 'GET' and path in self.streams:
+                    await self.stream(path, reader, writer)
+                    break
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b""
+                response = self.callApp(method, path, query, version, headers,
+                                        body, peer)
+                writer.write(response)
+                if not self.quiet:
+                    self.log(peer, method, target, version, response)
+                if not keepAlive(version, headers):
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, path, reader, writer):
+        """ Subscribe this connection to path until the client goes away. """
+        broadcaster = self.streams[path]
+        transport = writer.transport
+        writer.write(STREAM_HEADERS)
+        if broadcaster.payload is not None:
+            writer.write(broadcaster.payload)
+        self.subscribers[path].add(transport)
+        broadcaster.subscribe()
+        try:
+            while await reader.read(1024):
+                pass
+        finally:
+            self.subscribers[path].discard(transport)
+            broadcaster.unsubscribe()
+
+    def callApp(self, method, path, query, version, headers, body, peer):
+        """ Run the WSGI app for one request and return the response bytes. """
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote(path, 'latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0] if peer else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        started = []
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [status, response_headers]
+            return lambda data: None ## legacy write() isn't supported
+        result = self.app(environ, start_response)
+        try:
+            payload = b"".join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        status, response_headers = started
+        lines = ["HTTP/1.1 {}".format(status)]
+        has_length = False
+        for name, value in response_headers:
+            if name.lower() == 'content-length':
+                has_length = True
+            lines.append("{}: {}".format(name, value))
+        if not has_length and not status.startswith('304'):
+            lines.append("Content-Length: {}".format(len(payload)))
+        if not keepAlive(version, headers):
+            lines.append("Connection: close")
+        lines.append("\r\n")
+        return "\r\n".join(lines).encode('latin-1') + payload
+
+    def log(self, peer, method, target, version, response):
+        status = response[9:12].decode('latin-1')
+        print('{} - - [{}] "{} {} {}" {}'.format(
+              peer[0] if peer else '-', time.strftime('%d/%b/%Y %H:%M:%S'),
+              method, target, version, status), file=sys.stderr)
+
+def parseHead(head):
+    """
+    Split a raw request head into (method, target, version, headers).
+    Header names are lower-cased. Raises ValueError if malformed.
+    """
+    lines = head.decode('latin-1').split("\r\n")
+    method, target, version = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+def keepAlive(version, headers):
+    """ True if the connection should stay open after this request. """
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+class AsyncioServer(bottle.ServerAdapter):
+    """
+    Bottle adapter for AsyncHTTPServer. Pass streams={path: broadcaster}
+    through bottle.run() to enable native push streams.
+    """
+    def run(self, handler):
+        AsyncHTTPServer(handler, self.host, self.port,
+                        streams=self.options.get('streams'),
+                        quiet=self.quiet).run()
+
+bottle.server_names['asyncio'] = AsyncioServer
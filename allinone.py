@@ -79,6 +79,10 @@ except NameError:
     import subprocess
     import bottle
     from traceback import format_exc
+    try:
+        import numpy ## optional, speeds up stategen() for large nitems
+    except ImportError:
+        numpy = None
 
     # Create an app instance.
     app = bottle.Bottle()
@@ -124,8 +128,13 @@ except NameError:
         statekeys = common.statekeys
         _state['step'] = (-common.stepsize, 0.0, common.stepsize)
         _state['stepsize'] = common.stepsize
-        statevalues = [round(random.random()*10, 2) for n in range(nitems)]
-        _state.update(dict(zip(statekeys, statevalues)))
+        if numpy is None:
+            statevalues = [round(random.random()*10, 2) for n in range(nitems)]
+        else:
+            ## All values in one array, walked with vector ops.
+            rng = numpy.random.default_rng()
+            statevalues = numpy.round(rng.random(nitems) * 10, 2)
+        _state.update(zip(statekeys, list(statevalues)))
         while True:
             ## Update no more frequently than twice per second
             now = time.time()
@@ -133,9 +142,14 @@ except NameError:
                 last = now
                 counter += 1
                 step = _state['step']
-                statevalues = [round(v + random.choice(step), 2) for v in statevalues]
-                statevalues = [min(10.0, max(0.0, v)) for v in statevalues]
-                _state.update(dict(zip(statekeys, statevalues)))
+                if numpy is None:
+                    statevalues = [round(v + random.choice(step), 2) for v in statevalues]
+                    statevalues = [min(10.0, max(0.0, v)) for v in statevalues]
+                    _state.update(zip(statekeys, statevalues))
+                else:
+                    delta = rng.integers(-1, 2, size=nitems) * _state['stepsize']
+                    statevalues = numpy.clip(numpy.round(statevalues + delta, 2), 0.0, 10.0)
+                    _state.update(zip(statekeys, statevalues.tolist()))
                 _state['count'] = counter
             yield
 
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Description: In-memory cache of the built static files.
+
+index.html and client.js only change when doBuild() writes them, so there
+is no reason to stat, open and read them on every request. The server loads
+each one into an Asset once, along with gzip (and brotli, if installed)
+copies at maximum compression and a strong ETag taken from a content hash.
+The cache is refreshed only after a build succeeds, and only for files it
+rewrote, so while a build is writing its outputs requests keep getting the
+last good copies.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import os
+import hashlib
+
+from snapshot import compressVariants, chooseBody
+
+def fileStat(path):
+    """ (mtime_ns, size) of a path or file descriptor, None if missing. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def contentHash(data):
+    """ Short hex digest identifying data, for ETags and cache busting. """
+    return hashlib.sha1(data).hexdigest()[:16]
+
+class Asset:
+    """
+    One file held in memory. version is its content hash and etag the
+    quoted form of it.
+    """
+    __slots__ = ('path', 'content_type', 'version', 'etag', 'data', 'variants',
+                 'stat')
+
+    def __init__(self, path, content_type):
+        self.path = path
+        self.content_type = content_type
+        with open(path, 'rb') as f:
+            self.stat = fileStat(f.fileno())
+            self.data = f.read()
+        self.version = contentHash(self.data)
+        self.etag = '"{}"'.format(self.version)
+        self.variants = compressVariants(self.data, level='max')
+
+    def body(self, accept_encoding):
+        """ Return (bytes, coding) as for snapshot.Snapshot.body(). """
+        return chooseBody(self.data, self.variants, accept_encoding)
+
+class AssetCache:
+    """
+    Maps a name to the Asset for a file. Register files with add(); they
+    are read on first use and again only by refresh().
+    """
+    def __init__(self):
+        self.files = {}
+        self.assets = {}
+
+    def add(self, name, path, content_type):
+        """
+        Register path, served as content_type, under name, replacing any
+        earlier registration of name.
+        """
+        self.files[name] = (path, content_type)
+        self.assets.pop(name, None)
+
+    def get(self, name):
+        """
+        Return the Asset for name, loading it if needed.
+        Raises: KeyError if name isn't registered, OSError if the file
+        can't be read.
+        """
+        asset = self.assets.get(name)
+        if asset is None:
+            asset = Asset(*self.files[name])
+            self.assets[name] = asset
+        return asset
+
+    def peek(self, name):
+        """ Return the Asset for name if it is loaded, else None. """
+        return self.assets.get(name)
+
+    def preload(self):
+        """ Load every registered file that exists and isn't loaded yet. """
+        for name, (path, content_type) in self.files.items():
+            if name not in self.assets and os.path.exists(path):
+                self.get(name)
+
+    def refresh(self, paths=()):
+        """
+        Reload registered assets whose file is among paths or has changed
+        on disk since it was loaded. All reloaded assets are swapped in at
+        once, so a request never sees a new index.html with an old
+        client.js or vice versa.
+        """
+        assets = dict(self.assets)
+        for name, (path, content_type) in self.files.items():
+            loaded = assets.get(name)
+            if (path in paths or loaded is None
+                or loaded.stat != fileStat(path)) and os.path.exists(path):
+                assets[name] = Asset(path, content_type)
+        self.assets = assets
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description: Requests/sec for /getstate, per-request JSON vs the
+serialize-once snapshot.
+
+Calls the Bottle app in-process through WSGI, so the numbers measure handler
+and encoding cost without any network or server overhead. 'dict' is the old
+behavior, Bottle running json.dumps on _state for every request. 'snapshot'
+is the current /getstate writing the pre-encoded buffer, and 'binary' the
+same for a client asking for the binary format of wire.py. Run from the repo
+root, one process per size because common.nitems is read at import time:
+
+    $ python bench/bench_getstate.py
+    $ python bench/bench_getstate.py --sizes 10000 --encoding gzip
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+License: MIT License
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def wsgiGet(app, path, headers=None):
+    """ Call app for a GET on path and return the body length. """
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http', 'wsgi.input': None}
+    for name, value in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    def start_response(status, headers, exc_info=None):
+        pass
+    return sum(len(chunk) for chunk in app(environ, start_response))
+
+def requestRate(app, path, headers, secs):
+    """ Return (requests/sec, body bytes) for path over secs seconds. """
+    n = 0
+    nbytes = wsgiGet(app, path, headers)
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < secs:
+        wsgiGet(app, path, headers)
+        n += 1
+    return n / (time.perf_counter() - t0), nbytes
+
+def runOne(nitems, encoding, secs):
+    """ Benchmark one size in this process and print result rows. """
+    sys.path.insert(0, ROOT)
+    import common
+    common.nitems = nitems
+    common.statekeys = ["item{}".format(n) for n in range(nitems)]
+    import server
+
+    @server.app.route('/bench/dictstate')
+    def dictstate():
+        server.currentSnapshot()
+        return server._state
+
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    binary = dict(headers, Accept=common.wire_type)
+    for label, path, hdrs in (('dict', '/bench/dictstate', headers),
+                              ('snapshot', '/getstate', headers),
+                              ('binary', '/getstate', binary)):
+        rate, nbytes = requestRate(server.app, path, hdrs, secs)
+        print("{:>10} {:>10} {:>12.0f} {:>12}".format(label, nitems, rate, nbytes))
+        sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="/getstate throughput benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--encoding', default='',
+                        help="Accept-Encoding to send, e.g. gzip (default: none)")
+    parser.add_argument('--secs', type=float, default=2.0,
+                        help="seconds to run each case (default: 2)")
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.one is not None:
+        runOne(args.one, args.encoding, args.secs)
+        return
+
+    print("{:>10} {:>10} {:>12} {:>12}".format('handler', 'nitems', 'req/s', 'bytes'))
+    for nitems in args.sizes:
+        subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                               '--one', str(nitems), '--secs', str(args.secs),
+                               '--encoding', args.encoding])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description: Load test of the running server over HTTP on localhost.
+
+Starts server.serve() for each server backend and number of items, then
+runs N polling clients that behave like client.py without EventSource:
+every 0.5 seconds each asks /getstate for what changed since the tick it
+has, with If-None-Match, JSON or binary frames (--format). W writers post
+a new step size to /setstepsize every --write-interval seconds. After a
+warmup, requests are timed for --secs seconds and the table printed gives
+per endpoint the achieved requests/sec, p50, p99 and max latency, bytes
+per response, errors and polls that missed their slot because the
+previous one was still waiting, plus the server's CPU time per request.
+With --interval 0 the pollers go back to back, to find the most a backend
+sustains.
+
+By default the server runs in its own process, as it would in use, and its
+CPU time, workers included, is read from /proc (Linux only, otherwise
+reported as null). --inprocess runs it in a thread next to the clients
+instead, in a fresh process per case, whose CPU time then includes the
+clients'. Either way each case gets a fresh process, since common.nitems is
+read at import time. The clients all run on one asyncio event loop.
+
+Every case is also written, with the options and the machine, Python and
+git revision it ran on, to a JSON file (--out) for comparing runs. Run from
+the repo root:
+
+    $ python bench/bench_load.py
+    $ python bench/bench_load.py --backends asyncio --sizes 10000 --pollers 500
+    $ python bench/bench_load.py --interval 0 --pollers 16 --workers 4
+
+Start from a built client (run the server once) so that no Transcrypt run
+competes with the clients for the CPU.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+License: MIT License
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HOST = '127.0.0.1'
+## Same as common.wire_type, without importing the app into the client.
+WIRE_TYPE = 'application/x-nppwad-state'
+COUNT = re.compile(rb'"count":\s*(\d+)')
+
+def loadServer(nitems):
+    """ Import the server module with nitems state items. """
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import common
+    common.nitems = nitems
+    common.statekeys = ["item{}".format(n) for n in range(nitems)]
+    import server
+    return server
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+def processCPU(pid):
+    """
+    CPU seconds used so far by process pid and its descendants, e.g.
+    mpserve workers, or None where /proc doesn't tell.
+    """
+    tick = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    todo = [pid]
+    try:
+        while todo:
+            pid = todo.pop()
+            with open('/proc/{}/stat'.format(pid)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / tick
+            for task in os.listdir('/proc/{}/task'.format(pid)):
+                with open('/proc/{}/task/{}/children'.format(pid, task)) as f:
+                    todo.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError, IndexError):
+        return None
+    return total
+
+def percentile(ordered, p):
+    """ The p'th percentile, nearest rank, of a sorted list, or None. """
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+class Connection:
+    """
+    A keep-alive HTTP/1.1 client connection to port on localhost, opened
+    when needed and again after the server closes it, as wsgiref does after
+    every response.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, target, headers, body=b''):
+        """ Return (status, lowercased headers, body). """
+        reused = self.writer is not None
+        try:
+            return await self._request(method, target, headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        ## The server closed the idle connection; one retry on a new one.
+        return await self._request(method, target, headers, body)
+
+    async def _request(self, method, target, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(HOST, self.port)
+        lines = ["{} {} HTTP/1.1".format(method, target),
+                 "Host: {}:{}".format(HOST, self.port)]
+        lines.extend("{}: {}".format(name, value) for name, value in headers.items())
+        if body:
+            lines.append("Content-Length: {}".format(len(body)))
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        version, status = line.split()[:2]
+        status = int(status)
+        fields = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            fields[name.strip().lower()] = value.strip()
+        if 'content-length' in fields:
+            data = await self.reader.readexactly(int(fields['content-length']))
+        elif status in (204, 304):
+            data = b''
+        else:
+            data = await self.reader.read()
+            self.close()
+        connection = fields.get('connection', '').lower()
+        if connection == 'close' or (version == b'HTTP/1.0'
+                                     and connection != 'keep-alive'):
+            self.close()
+        return status, fields, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+class Stats:
+    """ What one endpoint's requests took while recording is on. """
+    def __init__(self):
+        self.recording = False
+        self.latencies = []
+        self.nbytes = 0
+        self.errors = 0
+        self.missed = 0
+        self.statuses = {}
+
+    def record(self, seconds, status, nbytes):
+        if self.recording:
+            self.latencies.append(seconds)
+            self.nbytes += nbytes
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status >= 400:
+                self.errors += 1
+
+    def error(self):
+        if self.recording:
+            self.errors += 1
+
+    def summary(self, secs):
+        ordered = sorted(self.latencies)
+        ms = lambda s: None if s is None else round(s * 1e3, 3)
+        return dict(requests=len(ordered),
+                    req_per_s=round(len(ordered) / secs, 1),
+                    p50_ms=ms(percentile(ordered, 50)),
+                    p99_ms=ms(percentile(ordered, 99)),
+                    max_ms=ms(ordered[-1] if ordered else None),
+                    bytes_per_response=(self.nbytes // len(ordered)
+                                        if ordered else None),
+                    errors=self.errors, missed=self.missed,
+                    statuses={str(k):v for k, v in sorted(self.statuses.items())})
+
+async def paced(interval, until, fn, stats):
+    """
+    Call coroutine fn every interval seconds, or back to back if interval
+    is 0, from a random phase until loop time until. Slots missed because
+    a call overran are skipped and counted, as Ticker does.
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(random.random() * interval)
+    due = loop.time()
+    while loop.time() < until:
+        await fn()
+        due += interval
+        delay = due - loop.time()
+        if interval and delay < 0:
+            missed = int(-delay // interval) + 1
+            if stats.recording:
+                stats.missed += missed
+            due += missed * interval
+            delay = due - loop.time()
+        await asyncio.sleep(max(delay, 0))
+
+def poller(port, stats, fmt, encoding):
+    """ A client polling /getstate, returning a coroutine function for paced(). """
+    conn = Connection(port)
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    if fmt == 'binary':
+        headers['Accept'] = WIRE_TYPE
+    have = {'count':None, 'etag':None}
+    async def poll():
+        target = '/getstate'
+        if have['count'] is not None:
+            target += '?since={}'.format(have['count'])
+        sent = dict(headers)
+        if have['etag']:
+            sent['If-None-Match'] = have['etag']
+        t0 = time.perf_counter()
+        try:
+            status, fields, body = await conn.request('GET', target, sent)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            conn.close()
+            stats.error()
+            return
+        stats.record(time.perf_counter() - t0, status, len(body))
+        if status == 200:
+            have['etag'] = fields.get('etag')
+            if fields.get('content-encoding') == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            if fmt == 'binary':
+                have['count'] = struct.unpack_from('<I', body)[0]
+            else:
+                found = COUNT.search(body)
+                have['count'] = int(found.group(1)) if found else None
+    return poll, conn
+
+def writer(port, stats):
+    """ A client posting step sizes, returning a coroutine function for paced(). """
+    conn = Connection(port)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    async def write():
+        body = 'stepsize={:.2f}'.format(random.uniform(0.1, 1.0)).encode('ascii')
+        t0 = time.perf_counter()
+        try:
+            status, fields, data = await conn.request('POST', '/setstepsize',
+                                                      headers, body)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            conn.close()
+            stats.error()
+            return
+        stats.record(time.perf_counter() - t0, status, len(data))
+    return write, conn
+
+async def waitReady(port, timeout=60.0):
+    """ Wait until the server answers /getstate. """
+    deadline = time.monotonic() + timeout
+    while True:
+        conn = Connection(port)
+        try:
+            status, _, _ = await conn.request('GET', '/getstate', {})
+            if status == 200:
+                return
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            conn.close()
+        if time.monotonic() > deadline:
+            raise RuntimeError("server on port {} didn't start".format(port))
+        await asyncio.sleep(0.2)
+
+async def drive(port, opts, cpu):
+    """
+    Run the clients against the server on port, recording for opts.secs
+    after opts.warmup. cpu() returns CPU seconds used so far, or None.
+    Returns: (dict of Stats by endpoint, CPU seconds while recording or None)
+    """
+    loop = asyncio.get_running_loop()
+    await waitReady(port)
+    stats = {'/getstate':Stats(), '/setstepsize':Stats()}
+    until = loop.time() + opts.warmup + opts.secs
+    tasks = []
+    conns = []
+    for n in range(opts.pollers):
+        fn, conn = poller(port, stats['/getstate'], opts.format, opts.encoding)
+        tasks.append(paced(opts.interval, until, fn, stats['/getstate']))
+        conns.append(conn)
+    for n in range(opts.writers):
+        fn, conn = writer(port, stats['/setstepsize'])
+        tasks.append(paced(opts.write_interval, until, fn, stats['/setstepsize']))
+        conns.append(conn)
+    async def record():
+        await asyncio.sleep(opts.warmup)
+        start = cpu()
+        for s in stats.values():
+            s.recording = True
+        await asyncio.sleep(opts.secs)
+        for s in stats.values():
+            s.recording = False
+        end = cpu()
+        return None if start is None or end is None else end - start
+    results = await asyncio.gather(record(), *tasks)
+    for conn in conns:
+        conn.close()
+    return stats, results[0]
+
+def runCase(port, opts, cpu, case):
+    """ Drive one case and return its result row. """
+    stats, cpusecs = asyncio.run(drive(port, opts, cpu))
+    row = dict(case)
+    row['endpoints'] = {path:s.summary(opts.secs) for path, s in stats.items()}
+    nrequests = sum(len(s.latencies) for s in stats.values())
+    row['req_per_s'] = round(nrequests / opts.secs, 1)
+    row['cpu_seconds'] = None if cpusecs is None else round(cpusecs, 3)
+    row['cpu_ms_per_request'] = (round(cpusecs / nrequests * 1e3, 3)
+                                 if cpusecs is not None and nrequests else None)
+    return row
+
+def serveOne(opts):
+    """ Body of the server process of a case: serve until killed. """
+    server = loadServer(opts.nitems)
+    server.serve(server=opts.backend, port=opts.port, tick=opts.tick,
+                 workers=opts.workers, metrics=not opts.no_metrics,
+                 quiet=True)
+
+def caseOf(opts):
+    return dict(backend=opts.backend, workers=opts.workers, nitems=opts.nitems,
+                pollers=opts.pollers, writers=opts.writers,
+                interval=opts.interval, format=opts.format,
+                encoding=opts.encoding, metrics=not opts.no_metrics,
+                mode='inprocess' if opts.inprocess else 'subprocess')
+
+def inprocessOne(opts):
+    """
+    Body of the process of an --inprocess case: serve from a thread, drive
+    the clients from this one and print the result row as JSON.
+    """
+    server = loadServer(opts.nitems)
+    port = freePort()
+    thread = threading.Thread(target=server.serve, daemon=True,
+                              kwargs=dict(server=opts.backend, port=port,
+                                          tick=opts.tick,
+                                          metrics=not opts.no_metrics,
+                                          quiet=True))
+    thread.start()
+    row = runCase(port, opts, time.process_time, caseOf(opts))
+    print(json.dumps(row))
+
+def caseArgs(opts, nitems, backend):
+    """ The command line passing one case of opts to a child process. """
+    args = [sys.executable, os.path.abspath(__file__),
+            '--nitems', str(nitems), '--backend', backend]
+    for name in ('workers', 'pollers', 'writers', 'interval', 'write_interval',
+                 'format', 'encoding', 'secs', 'warmup', 'tick'):
+        args += ['--' + name.replace('_', '-'), str(getattr(opts, name))]
+    if opts.no_metrics:
+        args.append('--no-metrics')
+    return args
+
+def runSubprocess(opts, nitems, backend):
+    """ Serve one case from a child process and drive it from this one. """
+    port = freePort()
+    proc = subprocess.Popen(caseArgs(opts, nitems, backend)
+                            + ['--serve', '--port', str(port)],
+                            cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=None if opts.verbose else subprocess.DEVNULL)
+    try:
+        case = argparse.Namespace(**dict(vars(opts), nitems=nitems,
+                                         backend=backend))
+        return runCase(port, opts, lambda: processCPU(proc.pid), caseOf(case))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+def runInprocess(opts, nitems, backend):
+    """ Run one case in a fresh process, server and clients together. """
+    out = subprocess.check_output(caseArgs(opts, nitems, backend) + ['--inprocess'],
+                                  cwd=ROOT,
+                                  stderr=None if opts.verbose else subprocess.DEVNULL)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+ROW = "{:>8} {:>3} {:>8} {:>13} {:>9} {:>9} {:>9} {:>9} {:>8} {:>7} {:>7} {:>9}"
+
+def printRow(row):
+    cpu = row['cpu_ms_per_request']
+    for path, s in row['endpoints'].items():
+        if not s['requests'] and not s['errors']:
+            continue
+        print(ROW.format(row['backend'], row['workers'], row['nitems'], path,
+                         s['req_per_s'], s['p50_ms'], s['p99_ms'], s['max_ms'],
+                         s['bytes_per_response'], s['errors'], s['missed'],
+                         '' if cpu is None else cpu))
+        sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Server load test")
+    parser.add_argument('--backends', nargs='+', default=['wsgiref', 'asyncio'],
+                        help="server backends to test (default: wsgiref asyncio)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000],
+                        help="numbers of state items to test")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="serving processes, see mpserve.py (default: 1)")
+    parser.add_argument('--pollers', type=int, default=100,
+                        help="polling clients (default: 100)")
+    parser.add_argument('--writers', type=int, default=1,
+                        help="clients posting /setstepsize (default: 1)")
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help="seconds between polls, 0 for back to back "
+                             "(default: 0.5, as client.py)")
+    parser.add_argument('--write-interval', type=float, default=1.0,
+                        help="seconds between step size posts (default: 1)")
+    parser.add_argument('--format', choices=('json', 'binary'), default='json',
+                        help="state format the pollers ask for (default: json)")
+    parser.add_argument('--encoding', default='gzip',
+                        help="Accept-Encoding the pollers send (default: gzip)")
+    parser.add_argument('--secs', type=float, default=10.0,
+                        help="seconds to record each case (default: 10)")
+    parser.add_argument('--warmup', type=float, default=2.0,
+                        help="seconds to run before recording (default: 2)")
+    parser.add_argument('--tick', type=float, default=0.5,
+                        help="server seconds between state updates (default: 0.5)")
+    parser.add_argument('--no-metrics', action='store_true',
+                        help="serve with metrics recording off")
+    parser.add_argument('--inprocess', action='store_true',
+                        help="run the server in the clients' process")
+    parser.add_argument('--out', default='bench_load.json',
+                        help="file to write the results to (default: bench_load.json)")
+    parser.add_argument('--verbose', action='store_true',
+                        help="show the server's stderr")
+    ## One case, in a child process.
+    parser.add_argument('--nitems', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+    if opts.encoding == 'none':
+        opts.encoding = ''
+    if opts.nitems is not None:
+        if opts.serve:
+            serveOne(opts)
+        else:
+            inprocessOne(opts)
+        return
+    if opts.inprocess and opts.workers > 1:
+        parser.error("--workers needs the server in its own process")
+
+    print(ROW.format('backend', 'wkr', 'nitems', 'endpoint', 'req/s', 'p50 ms',
+                     'p99 ms', 'max ms', 'bytes', 'errors', 'missed', 'cpu ms/req'))
+    rows = []
+    for nitems in opts.sizes:
+        for backend in opts.backends:
+            run = runInprocess if opts.inprocess else runSubprocess
+            row = run(opts, nitems, backend)
+            printRow(row)
+            rows.append(row)
+
+    results = dict(created=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                   revision=gitRevision(),
+                   python=platform.python_version(),
+                   platform=platform.platform(), cpus=os.cpu_count(),
+                   options={name:value for name, value in vars(opts).items()
+                            if name not in ('nitems', 'backend', 'port', 'serve')},
+                   results=rows)
+    with open(opts.out, 'w') as f:
+        json.dump(results, f, indent=1)
+    print("Results written to {}".format(opts.out))
+
+if __name__ == '__main__':
+    main()
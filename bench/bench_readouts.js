@@ -0,0 +1,112 @@
+/*
+ * Description: Browser side of bench/bench_readouts.py.
+ *
+ * Defines window.benchReadouts, which start() in client.py calls instead
+ * of running the app. For each size in the page's ?sizes=, fills the body
+ * with that many readouts, then on every animation frame random walks
+ * their values the way the server does and hands the new state to
+ * receiveState(). Records the time renderReadouts() takes and the
+ * interval between frames, which includes the browser's style and layout
+ * work. Shows the results and posts them to /benchresult as JSON.
+ *
+ * renderReadouts() runs from an animation frame callback that
+ * receiveState() schedules, so it is timed by callbacks scheduled just
+ * before and just after it, which the browser runs in order in the same
+ * frame.
+ *
+ * This file is part of NearlyPurePythonWebAppDemo
+ * https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+ *
+ * License: MIT License
+ */
+"use strict";
+
+/* Mean, median, 95th percentile and maximum of an array of numbers. */
+function summarize(times) {
+    var ordered = times.slice().sort(function (a, b) { return a - b; });
+    var n = ordered.length;
+    if (n === 0) {
+        return {};
+    }
+    var sum = ordered.reduce(function (a, b) { return a + b; }, 0);
+    return {mean: sum / n, p50: ordered[Math.floor(n * 0.5)],
+            p95: ordered[Math.min(n - 1, Math.floor(n * 0.95))],
+            max: ordered[n - 1]};
+}
+
+window.benchReadouts = function (bindReadouts, receiveState) {
+    var params = new URLSearchParams(window.location.search);
+    var sizes = (params.get('sizes') || '10,100,1000').split(',').map(Number);
+    var frames = Number(params.get('frames') || 120);
+    var steps = [-0.5, 0.0, 0.5];
+    var results = {};
+
+    function runSize(i) {
+        if (i >= sizes.length) {
+            var text = JSON.stringify(results);
+            var pre = document.createElement('pre');
+            pre.style.color = 'white';
+            pre.textContent = text;
+            document.body.innerHTML = '';
+            document.body.appendChild(pre);
+            var request = new XMLHttpRequest();
+            request.open('POST', '/benchresult', true);
+            request.setRequestHeader('Content-Type',
+                                     'application/x-www-form-urlencoded; charset=UTF-8');
+            request.send('results=' + encodeURIComponent(text));
+            return;
+        }
+        var nitems = sizes[i];
+        var keys = [];
+        var content = document.createElement('div');
+        for (var n = 0; n < nitems; n++) {
+            var key = 'item' + n;
+            var el = document.createElement('div');
+            el.className = 'readout';
+            el.setAttribute('data-key', key);
+            el.textContent = 'waiting ...';
+            content.appendChild(el);
+            keys.push(key);
+        }
+        document.body.innerHTML = '';
+        document.body.appendChild(content);
+        bindReadouts();
+
+        var state = {stepsize: 0.5};
+        keys.forEach(function (key) {
+            state[key] = Math.round(Math.random() * 1000) / 100;
+        });
+        var renderMs = [];
+        var frameMs = [];
+        var last = null;
+        var t0 = 0;
+
+        function before() {
+            t0 = performance.now();
+        }
+        function after(now) {
+            if (last !== null) {
+                frameMs.push(now - last);
+                renderMs.push(performance.now() - t0);
+            }
+            last = now;
+            if (frameMs.length >= frames) {
+                results[String(nitems)] = {render: summarize(renderMs),
+                                           frame: summarize(frameMs)};
+                runSize(i + 1);
+                return;
+            }
+            var next = {stepsize: 0.5};
+            keys.forEach(function (key) {
+                var v = state[key] + steps[Math.floor(Math.random() * 3)];
+                next[key] = Math.round(Math.min(10, Math.max(0, v)) * 100) / 100;
+            });
+            state = next;
+            window.requestAnimationFrame(before);
+            receiveState(state);
+            window.requestAnimationFrame(after);
+        }
+        window.requestAnimationFrame(after);
+    }
+    runSize(0);
+};
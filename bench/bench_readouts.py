@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description: Browser frame times of the readout update path at several
+numbers of readouts.
+
+Starts the server in this process, with extra /bench and /benchresult
+routes, and prints a URL to open in a browser (or pass --open). /bench is
+the home page plus bench_readouts.js, which drives renderReadouts() in
+client.py with a new random walk step on every animation frame, then posts
+its timings back to /benchresult. 'render' is the time spent writing the DOM in renderReadouts();
+'frame' is the interval between animation frames, which adds the browser's
+style and layout work and is 16.7 ms at best on a 60 Hz display. Run from
+the repo root:
+
+    $ python bench/bench_readouts.py --open
+    $ python bench/bench_readouts.py --sizes 1000 50000 --frames 300 --out frames.json
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+License: MIT License
+"""
+import os
+import sys
+import json
+import queue
+import argparse
+import threading
+import webbrowser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+
+def main():
+    parser = argparse.ArgumentParser(description="Readout frame time benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--frames', type=int, default=120,
+                        help="frames to time per size (default: 120)")
+    parser.add_argument('--port', type=int, default=8801)
+    parser.add_argument('--open', action='store_true',
+                        help="open the benchmark page in the default browser")
+    parser.add_argument('--timeout', type=float, default=600,
+                        help="seconds to wait for the results (default: 600)")
+    parser.add_argument('--out', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    import server
+
+    @server.app.get('/bench')
+    def bench():
+        return server.buildIndexHtml().replace(
+               '<head>', '<head><script src="/bench_readouts.js"></script>', 1)
+
+    @server.app.get('/bench_readouts.js')
+    def benchjs():
+        return server.bottle.static_file('bench_readouts.js', root=HERE,
+                                         mimetype='application/javascript')
+
+    results = queue.Queue()
+    @server.app.post('/benchresult')
+    def benchresult():
+        results.put(json.loads(server.request.forms.get('results')))
+        return {}
+
+    threading.Thread(target=server.serve, kwargs=dict(port=args.port),
+                     daemon=True).start()
+    url = 'http://localhost:{}/bench?sizes={}&frames={}'.format(
+          args.port, ','.join(str(n) for n in args.sizes), args.frames)
+    print("Open {} in a browser to run the benchmark".format(url))
+    if args.open:
+        webbrowser.open(url)
+    try:
+        data = results.get(timeout=args.timeout)
+    except queue.Empty:
+        sys.exit("No results after {:.0f}s".format(args.timeout))
+
+    print("{:>8} {:>12} {:>12} {:>12} {:>12}".format(
+          'nitems', 'render ms', 'render p95', 'frame ms', 'frame p95'))
+    for nitems in args.sizes:
+        row = data.get(str(nitems), {})
+        render, frame = row.get('render', {}), row.get('frame', {})
+        print("{:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}".format(
+              nitems, render.get('mean', 0), render.get('p95', 0),
+              frame.get('mean', 0), frame.get('p95', 0)))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(dict(frames=args.frames, results=data), f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description: Measure the cost of one state tick for each state engine.
+
+A tick is engine.step() plus copying the values into the _state dict the way
+server.stategen() does. 'history' is the added cost of recording the tick in
+a history.History, averaged over its rollups, and 'max' the worst case,
+a tick completing a bucket in every tier. Run from the repo root:
+
+    $ python bench/bench_stategen.py
+    $ python bench/bench_stategen.py --sizes 10 1000 --engines array
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+License: MIT License
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stateengine
+import history
+
+def timeTicks(kind, nitems, minsecs=1.0, maxticks=1000):
+    """
+    Tick an engine of the given kind repeatedly for at least minsecs (and at
+    least 3 ticks). Returns (step, tick, history, max) seconds per tick,
+    where step covers engine.step() only, tick adds the dict update,
+    history is the mean and max the longest History.record() call, both
+    None without numpy.
+    """
+    engine = stateengine.makeEngine(kind, nitems, 0.5)
+    keys = ["item{}".format(n) for n in range(nitems)]
+    state = dict(zip(keys, engine.tolist()))
+    past = history.History(keys) if history.numpy else None
+    steptime = ticktime = histtime = histmax = 0.0
+    n = 0
+    while n < 3 or (ticktime < minsecs and n < maxticks):
+        t0 = time.perf_counter()
+        engine.step()
+        t1 = time.perf_counter()
+        state.update(zip(keys, engine.tolist()))
+        t2 = time.perf_counter()
+        steptime += t1 - t0
+        ticktime += t2 - t0
+        n += 1
+        if past is not None:
+            past.record(n, engine.values)
+            t3 = time.perf_counter() - t2
+            histtime += t3
+            histmax = max(histmax, t3)
+    if past is None:
+        return steptime / n, ticktime / n, None, None
+    ## Time a tick rolling up every tier, however few ticks ran.
+    t0 = time.perf_counter()
+    past.record(history.DEFAULT_TIERS[-1][0], engine.values)
+    histmax = max(histmax, time.perf_counter() - t0)
+    return steptime / n, ticktime / n, histtime / n, histmax
+
+def ms(secs):
+    """ Format seconds as milliseconds, or n/a for None. """
+    return 'n/a' if secs is None else "{:.4f}".format(secs * 1e3)
+
+def main():
+    parser = argparse.ArgumentParser(description="State engine tick benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 1000, 100000, 1000000])
+    parser.add_argument('--engines', nargs='+', default=['list', 'array'])
+    args = parser.parse_args()
+    if stateengine.numpy is None and 'array' in args.engines:
+        print("numpy not installed, skipping the array engine")
+        args.engines.remove('array')
+
+    print("{:>8} {:>10} {:>14} {:>14} {:>14} {:>14}".format(
+          'engine', 'nitems', 'step ms', 'tick ms', 'history ms', 'max ms'))
+    for nitems in args.sizes:
+        for kind in args.engines:
+            times = timeTicks(kind, nitems)
+            print("{:>8} {:>10} {:>14} {:>14} {:>14} {:>14}".format(
+                  kind, nitems, *[ms(t) for t in times]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Fan-out of serialized state updates to push subscribers.
+
+The publisher hands over each new state as an already encoded payload, once
+per tick. Any number of subscriber threads block in wait() until a payload
+newer than the one they last sent is available, then write the same bytes
+object to their clients. Nothing is re-serialized per subscriber.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import threading
+
+class Broadcaster:
+    """
+    Holds the latest (seq, payload) pair. seq must increase with each publish.
+    """
+    def __init__(self):
+        self.seq = -1
+        self.payload = None
+        self.subscribers = 0
+        self.listeners = []
+        self._cond = threading.Condition()
+
+    def addListener(self, fn):
+        """
+        Have fn() called, from the publishing thread, after every publish.
+        Lets event loops learn about new payloads without a blocked thread.
+        """
+        self.listeners.append(fn)
+
+    def subscribe(self):
+        """ Count a new subscriber. Pair with unsubscribe(). """
+        with self._cond:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def publish(self, seq, payload):
+        """ Make payload the latest and wake all waiting subscribers. """
+        with self._cond:
+            self.seq = seq
+            self.payload = payload
+            self._cond.notify_all()
+        for fn in self.listeners:
+            fn()
+
+    def wait(self, after, timeout=None):
+        """
+        Block until a payload with seq > after is available or timeout
+        seconds have passed. Returns (seq, payload); payload is None on
+        timeout.
+        """
+        with self._cond:
+            if self.seq <= after:
+                self._cond.wait(timeout)
+            if self.seq <= after:
+                return after, None
+            return self.seq, self.payload
+
+def sseFrame(data, event=None, id=None):
+    """
+    Encode one Server-Sent Events message as bytes. data must be a str or
+    UTF-8 bytes without newlines, e.g. compact JSON.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    head = []
+    if event is not None:
+        head.append("event: {}\n".format(event))
+    if id is not None:
+        head.append("id: {}\n".format(id))
+    head.append("data: ")
+    return "".join(head).encode('utf-8') + data + b"\n\n"
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Content-addressed cache for slow build steps.
+
+Comparing modification times makes every target look stale after a git
+checkout, a touch or in a fresh container, even when no source byte
+changed. For the Transcrypt step that costs seconds. A BuildCache keys each
+build on the names and content hashes of its sources plus a salt, e.g. the
+Transcrypt version, and keeps a copy of the outputs it produced. Names are
+relative to the project, so the key survives moving the checkout. When the key has been
+seen before, the outputs are restored by copying instead of rebuilding.
+
+Layout on disk:
+    __buildcache__/<key>/meta.json    -- build duration and file list
+    __buildcache__/<key>/files/...    -- the outputs, relative to the base dir
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+
+def fileHash(path):
+    """ Hex sha1 of the contents of path. """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def toolVersion(distribution):
+    """ Installed version of a distribution, or 'unknown'. """
+    try:
+        from importlib.metadata import version
+        return version(distribution)
+    except Exception:
+        return 'unknown'
+
+def sourceName(path, base):
+    """
+    Name of the source file path that doesn't depend on where the project
+    or Python is installed: its path relative to base, the project
+    directory, or else relative to the sys.path entry it would be imported
+    from, e.g. 'htmltree/htmltree.py'.
+    """
+    path = os.path.abspath(path)
+    roots = [base] + [os.path.abspath(entry) for entry in sys.path if entry]
+    for root in sorted(roots, key=len, reverse=True):
+        if path.startswith(os.path.join(root, '')):
+            return os.path.relpath(path, root).replace(os.sep, '/')
+    return os.path.basename(path)
+
+class BuildCache:
+    """
+    Cache of build outputs under root, keeping the keep most recently used
+    entries. stats counts hits, misses and build seconds saved by hits.
+    Keys name sources relative to base, by default the directory holding
+    root, so a checkout moved or cloned elsewhere gets the same keys.
+    """
+    def __init__(self, root='__buildcache__', keep=10, base=None):
+        self.root = root
+        self.keep = keep
+        if base is None:
+            base = os.path.dirname(os.path.abspath(root))
+        self.base = os.path.abspath(base)
+        self.stats = dict(hits=0, misses=0, saved=0.0)
+
+    def key(self, sources, salt=''):
+        """
+        Key for building from sources (paths) with the given salt: a hash
+        of the salt and each source's name, see sourceName(), and contents.
+        """
+        h = hashlib.sha1(salt.encode('utf-8'))
+        names = sorted((sourceName(path, self.base), path) for path in sources)
+        for name, path in names:
+            h.update("\0{}\0{}".format(name, fileHash(path)).encode('utf-8'))
+        return h.hexdigest()
+
+    def lookup(self, key):
+        """ Return the meta dict of a cached build, or None. """
+        try:
+            with open(os.path.join(self.root, key, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def restore(self, key, base):
+        """
+        Copy the outputs of cached build key into base. Returns the meta
+        dict, or None on a miss. Updates stats either way.
+        """
+        meta = self.lookup(key)
+        if meta is None:
+            self.stats['misses'] += 1
+            return None
+        t0 = time.perf_counter()
+        files = os.path.join(self.root, key, 'files')
+        for rel in meta['files']:
+            dest = os.path.join(base, rel)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(files, rel), dest)
+        ## Mark as recently used for pruning.
+        os.utime(os.path.join(self.root, key, 'meta.json'))
+        meta['restore_seconds'] = time.perf_counter() - t0
+        self.stats['hits'] += 1
+        self.stats['saved'] += max(0.0, meta['seconds'] - meta['restore_seconds'])
+        return meta
+
+    def store(self, key, base, files, seconds):
+        """
+        Save files (paths relative to base) as the outputs of build key,
+        which took seconds to run, then prune old entries.
+        """
+        entry = os.path.join(self.root, key)
+        tmp = entry + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for rel in files:
+            dest = os.path.join(tmp, 'files', rel)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(base, rel), dest)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(dict(files=sorted(files), seconds=seconds,
+                           created=time.time()), f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.prune()
+
+    def prune(self):
+        """ Remove all but the keep most recently used entries. """
+        entries = []
+        for name in os.listdir(self.root):
+            meta = os.path.join(self.root, name, 'meta.json')
+            if os.path.exists(meta):
+                entries.append((os.stat(meta).st_mtime, name))
+        entries.sort(reverse=True)
+        for _, name in entries[self.keep:]:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+def changedSince(base, t, prefix=''):
+    """
+    Paths under base, relative to it, of files whose names start with
+    prefix and that were modified at or after time t.
+    """
+    changed = []
+    for dirpath, dirnames, filenames in os.walk(base):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name.startswith(prefix) and os.stat(path).st_mtime >= t:
+                changed.append(os.path.relpath(path, base))
+    return changed
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Small incremental build engine for the generated files.
+
+Each Target names its outputs, a function returning its input files and an
+action that writes the outputs. Targets may depend on other targets, whose
+outputs then count among their inputs. A target is rebuilt only when its
+outputs are missing or the fingerprint of its inputs has changed since its
+last successful build. The fingerprint is a content hash, not an mtime, so a
+touch or a checkout of identical files rebuilds nothing. Fingerprints are
+kept in a JSON manifest.
+
+build() works through the targets in dependency order. Stale targets whose
+dependencies are done run in parallel threads; the slow actions run
+subprocesses (Transcrypt), so threads are enough.
+
+BackgroundBuild runs a build function in its own thread, so a server can
+keep answering requests, from the outputs of the last good build, while a
+new one is in progress.
+
+importGraph() finds the project modules a Python file imports, directly or
+not, which is exactly the set of sources Transcrypt compiles into a bundle.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import os
+import sys
+import ast
+import time
+import json
+import hashlib
+import threading
+import traceback
+import sysconfig
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from buildcache import fileHash
+
+## Modules under these directories are never build inputs.
+_STDLIB = tuple(os.path.abspath(sysconfig.get_paths()[name]) + os.sep
+                for name in ('stdlib', 'platstdlib'))
+
+def findModule(name, base):
+    """
+    Return the .py file for module name as imported from a file in
+    directory base, or None if it is not a project or third party Python
+    source (e.g. stdlib, builtin or not found).
+    """
+    relpath = os.path.join(base, *name.split('.'))
+    for candidate in (relpath + '.py', os.path.join(relpath, '__init__.py')):
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    origin = spec.origin if spec is not None else None
+    if not origin or not origin.endswith('.py'):
+        return None
+    origin = os.path.abspath(origin)
+    if origin.startswith(_STDLIB) and 'site-packages' not in origin:
+        return None
+    return origin
+
+def importedNames(tree, path):
+    """ Yield the absolute module names imported in an ast tree of path. """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ''
+            if node.level:
+                ## Relative import: resolve against path's package.
+                package = os.path.dirname(path)
+                for _ in range(node.level - 1):
+                    package = os.path.dirname(package)
+                module = os.path.relpath(os.path.join(package, *module.split('.')))
+                module = module.replace(os.sep, '.')
+            if module:
+                yield module
+                for alias in node.names:
+                    if alias.name != '*':
+                        yield module + '.' + alias.name ## may be a submodule
+
+def importGraph(path):
+    """
+    Return the sorted absolute paths of path and every Python source it
+    imports, transitively, excluding the standard library. Dotted imports
+    also pull in their packages' __init__.py.
+    """
+    path = os.path.abspath(path)
+    seen = set()
+    todo = [path]
+    while todo:
+        current = todo.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        with open(current, 'rb') as f:
+            tree = ast.parse(f.read(), current)
+        base = os.path.dirname(current)
+        for name in importedNames(tree, current):
+            parts = name.split('.')
+            for n in range(1, len(parts) + 1):
+                found = findModule('.'.join(parts[:n]), base)
+                if found is not None and found not in seen:
+                    todo.append(found)
+    return sorted(seen)
+
+class Target:
+    """
+    A buildable thing. inputs() returns the input file paths; extra is an
+    optional function returning a string that also feeds the fingerprint,
+    e.g. the source of the function that renders the output. action(inputs)
+    writes the outputs and raises on failure. deps names targets that must
+    be built first; their outputs are added to the inputs.
+    """
+    def __init__(self, name, outputs, inputs, action, deps=(), extra=None):
+        self.name = name
+        self.outputs = list(outputs)
+        self.inputs = inputs
+        self.action = action
+        self.deps = tuple(deps)
+        self.extra = extra
+
+class Builder:
+    """
+    Builds Targets incrementally, with up to jobs running at once, recording
+    fingerprints in the JSON file manifest. observe, if set, is called as
+    observe(name, outcome, seconds) for each target build() looks at, with
+    outcome 'uptodate', 'built' or 'failed' and the time its action took.
+    """
+    def __init__(self, manifest, jobs=None):
+        self.manifest = manifest
+        self.jobs = jobs or os.cpu_count() or 1
+        self.targets = {}
+        self.observe = None
+
+    def add(self, target):
+        self.targets[target.name] = target
+        return target
+
+    def _load(self):
+        try:
+            with open(self.manifest) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, fingerprints):
+        os.makedirs(os.path.dirname(self.manifest) or '.', exist_ok=True)
+        tmp = self.manifest + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(fingerprints, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest)
+
+    def inputsOf(self, target):
+        """ All input paths of target, including its deps' outputs. """
+        paths = list(target.inputs())
+        for dep in target.deps:
+            paths.extend(self.targets[dep].outputs)
+        return paths
+
+    def fingerprint(self, target, inputs):
+        h = hashlib.sha1()
+        for path in sorted(inputs):
+            h.update("\0{}\0{}".format(path, fileHash(path)).encode('utf-8'))
+        if target.extra is not None:
+            h.update(target.extra().encode('utf-8'))
+        return h.hexdigest()
+
+    def build(self, names=None):
+        """
+        Bring the named targets (default: all) and their dependencies up to
+        date. Returns the outputs of the targets that were rebuilt.
+        Raises: the first exception raised by an action, after letting the
+        actions already running finish.
+        """
+        wanted = self._closure(names or list(self.targets))
+        fingerprints = self._load()
+        rebuilt = []
+        done = set()
+        running = {}  ## future -> target name
+        pending = {}  ## target name -> fingerprint to record on success
+        error = None
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while len(done) < len(wanted) and error is None:
+                for name in wanted:
+                    target = self.targets[name]
+                    if (name in done or name in running.values()
+                        or not done.issuperset(target.deps)):
+                        continue
+                    inputs = self.inputsOf(target)
+                    fp = self.fingerprint(target, inputs)
+                    if (fingerprints.get(name) == fp
+                        and all(os.path.exists(out) for out in target.outputs)):
+                        done.add(name)
+                        self._observe(name, 'uptodate', 0.0)
+                        continue
+                    pending[name] = fp
+                    running[pool.submit(self._run, target, inputs)] = name
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    done.add(name)
+                    fingerprints[name] = pending[name]
+                    rebuilt.extend(self.targets[name].outputs)
+            ## After an error, still record whatever else finishes.
+            for future, name in running.items():
+                if future.exception() is None:
+                    fingerprints[name] = pending[name]
+                    rebuilt.extend(self.targets[name].outputs)
+        self._save(fingerprints)
+        if error is not None:
+            raise error
+        return rebuilt
+
+    def _run(self, target, inputs):
+        """ Run target's action, reporting the outcome to observe. """
+        t0 = time.perf_counter()
+        try:
+            target.action(inputs)
+        except Exception:
+            self._observe(target.name, 'failed', time.perf_counter() - t0)
+            raise
+        self._observe(target.name, 'built', time.perf_counter() - t0)
+
+    def _observe(self, name, outcome, seconds):
+        if self.observe is not None:
+            self.observe(name, outcome, seconds)
+
+    def _closure(self, names):
+        """ names plus all their transitive deps, in dependency order. """
+        order = []
+        def visit(name, stack=()):
+            if name in order:
+                return
+            if name in stack:
+                raise ValueError("Dependency cycle at {}".format(name))
+            for dep in self.targets[name].deps:
+                visit(dep, stack + (name,))
+            order.append(name)
+        for name in names:
+            visit(name)
+        return order
+
+class BackgroundBuild:
+    """
+    Runs fn, a build function, in a daemon thread named name whenever
+    request() is called. Requests made during a run are merged into one
+    more run after it. A failing run never propagates: its traceback is
+    printed to stderr and kept in error until a later run succeeds. result
+    is the return value of the last successful run.
+    """
+    def __init__(self, fn, name='build'):
+        self.fn = fn
+        self.name = name
+        self.result = None
+        self.error = None
+        self.runs = 0
+        self._wanted = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def building(self):
+        """ True from a request() until the run(s) it caused are done. """
+        return not self._idle.is_set()
+
+    def request(self):
+        """ Start a run in the background, or another after the current one. """
+        with self._lock:
+            self._idle.clear()
+            self._wanted.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop,
+                                                name=self.name, daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        """ Block until no run is pending. Returns False on timeout. """
+        return self._idle.wait(timeout)
+
+    def runNow(self):
+        """
+        Run fn in the calling thread, reporting failure as a background
+        run would. Returns True on success.
+        """
+        try:
+            self.result = self.fn()
+        except Exception:
+            self.error = traceback.format_exc()
+            print("{} failed, still serving the last good build:\n{}".format(
+                  self.name, self.error), file=sys.stderr)
+            return False
+        else:
+            self.error = None
+            return True
+        finally:
+            self.runs += 1
+
+    def _loop(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            self.runNow()
+            with self._lock:
+                if not self._wanted.is_set():
+                    self._idle.set()
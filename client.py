@@ -17,42 +17,40 @@ from htmltree.htmltree import *
 
 _state = {}
 _prior_state = {}
+_state_etag = None
 _readouts = None
+## (element, state key) for each readout, bound once by bindReadouts(),
+## and the value and color band each readout was last written with.
+_bindings = []
+_shown = {}
+_shown_band = {}
+## True while a renderReadouts() call is waiting for the next frame.
+_frame_pending = False
+## The virtual readout list, used when there are more than
+## common.virtual_threshold readouts, see setupVirtualList(): its row
+## elements, recycled on scroll, the index of the item in the first one,
+## and the ?keys= range last fetched.
+_pool = []
+_first = -1
+_state_keys = None
+_scroll_pending = False
+_fetch_timer = None
+## The /schema response, which polling switches to binary frames once it
+## holds, see decodeFrame().
+_schema = None
 
 def makeBody():
     """
     Create HTML for the body element content. This is done as a demo to show
     that the code in htmltree.py works in Transcrypted JS as well as in Python.
-    It could have been accomplished just as easily on the server side.
+    The server can do the same, see serve(prerender=True) in server.py, in
+    which case start() skips this.
     """
-    banner = H1("Nearly Pure Python Web App Demo", style=dict(color='yellow'))
-    projectlink = A('Source Code on GitHub',
-                    href='https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo')
-    subbanner = H2(projectlink)
-
-    header = Div(banner, subbanner, style=dict(text_align='center'))
-
-    readouts = []
-    for datakey in common.statekeys:
-        readouts.append(Div('waiting ...', _class='readout', data_key=datakey))
-
-    stepinput = Label("Step Size",
-                  Input(id='stepinput', type='text', style=dict(margin='1em')),
-                style=dict(color='white'))
-
-    stepsubmit = Input(type="submit", value="Submit")
-
-    stepform = Form(
-                 Div(stepinput, stepsubmit, style=dict(margin='20px')),
-               id='setstep')
-
-    bodycontent = Div(header)
-    bodycontent.C.extend(readouts)
-    bodycontent.C.append(stepform)
-
-    ## Use the DOM API to insert rendered content
-    console.log(bodycontent.render())
-    document.body.innerHTML = bodycontent.render()
+    ## Use the DOM API to insert rendered content. Render once; with
+    ## thousands of readouts that is the bulk of the startup time. Later
+    ## updates write to the readout elements directly, see
+    ## renderReadouts(), so the tree isn't kept.
+    document.body.innerHTML = common.bodyContent().render()
 
 #########################################################
 # jQuery replacement functions
@@ -71,19 +69,28 @@ def triggerCustomEvent(name, data):
         event.initCustomEvent(name, True, True, data)
     document.dispatchEvent(event)
 
-def getJSON(url, f):
+def getJSON(url, f, etag=None):
     """
     JS version of jQuery.getJSON
     see http://youmightnotneedjquery.com/#get_json
     url must return a JSON string
-    f(data) handles an object parsed from the return JSON string
+    f(data, etag) handles an object parsed from the return JSON string.
+    etag is the response's ETag header, or null.
+
+    If an etag is passed in, it is sent as If-None-Match. The server answers
+    304 Not Modified when it still matches, and then f is not called.
     """
     request = __new__ (XMLHttpRequest())
     request.open('GET', url, True)
+    if etag:
+        request.setRequestHeader('If-None-Match', etag)
     def onload():
+        if request.status == 304:
+            return ## what we already have is current
         if 200 <= request.status < 400:
             data = JSON.parse(request.responseText)
-            f(data) ## call handler with object created from JSON string
+            ## call handler with object created from JSON string
+            f(data, request.getResponseHeader('ETag'))
         else:
             _ = "Server returned {} for getJSON request on {}".format(request.status, url)
             console.log(_)
@@ -94,6 +101,35 @@ def getJSON(url, f):
     request.onerror = onerror
     request.send()
 
+def getFrame(url, f, etag=None):
+    """
+    getJSON() for a binary state frame: asks for common.wire_type and calls
+    f(data, etag) with the frame decoded by decodeFrame(), so there is no
+    JSON.parse on this path.
+    """
+    request = __new__ (XMLHttpRequest())
+    request.open('GET', url, True)
+    request.responseType = 'arraybuffer'
+    request.setRequestHeader('Accept', common.wire_type)
+    if etag:
+        request.setRequestHeader('If-None-Match', etag)
+    def onload():
+        if request.status == 304:
+            return
+        if 200 <= request.status < 400:
+            data = decodeFrame(request.response)
+            if data is not None:
+                f(data, request.getResponseHeader('ETag'))
+        else:
+            _ = "Server returned {} for getFrame request on {}".format(request.status, url)
+            console.log(_)
+    def onerror():
+        _ = "Connection error for getFrame request on {}".format(url)
+        console.log(_)
+    request.onload = onload
+    request.onerror = onerror
+    request.send()
+
 def post(url, data):
     """
     JS version of jQuery.post
@@ -118,48 +154,266 @@ def post(url, data):
 # End of j!uery replacement functions
 ########################################################
 
-def getState():
-    """ Fetch JSON obj containing monitored variables. """
-    def f(data):
-        global _state, _prior_state
-        _prior_state.update(_state)
+def receiveState(data, etag=None):
+    """
+    Install a new state object from the server and announce it with the
+    'state:update' custom event. Delta responses, marked by a delta_since
+    key, are merged into the current state instead of replacing it.
+    etag, if any, is remembered for the next conditional /getstate.
+    """
+    global _state, _prior_state, _state_etag
+    _state_etag = etag
+    _prior_state.update(_state)
+    if data.hasOwnProperty('delta_since'):
+        ## data is a plain JS object from JSON.parse, so copy its keys
+        ## with the JS API rather than dict.update.
+        for key in Object.keys(data):
+            _state[key] = data[key]
+    else:
         _state = data
-        triggerCustomEvent('state:update', {})
-        #console.log(_state)
-    getJSON('/getstate', f)
-    return
+    triggerCustomEvent('state:update', {})
+    #console.log(_state)
 
-def update_readouts():
+def receiveSchema(data, etag=None):
+    """ Keep the /schema response for decodeFrame(). """
+    global _schema
+    _schema = data
+
+def decodeFrame(buf):
+    """
+    Turn a binary state frame, laid out as described in wire.py, into the
+    object /getstate would have sent as JSON. The values are read in place
+    through typed array views. Returns None, and fetches the schema again,
+    if the frame was encoded for other keys than the schema we hold.
+    """
+    global _schema
+    header = __new__(DataView(buf))
+    if _schema is None or header.getUint32(4, True) != _schema['schema']:
+        _schema = None
+        getJSON('/schema', receiveSchema)
+        return None
+    flags = header.getUint32(8, True)
+    nvalues = header.getUint32(16, True)
+    nranges = header.getUint32(20, True)
+    data = __new__(Object())
+    data['count'] = header.getUint32(0, True)
+    data['server_start_time'] = header.getFloat64(24, True)
+    data['stepsize'] = header.getFloat64(32, True)
+    chars = __new__(Uint8Array(buf, 40, 16))
+    version = ''
+    for i in range(16):
+        if chars[i] == 0:
+            break
+        version += String.fromCharCode(chars[i])
+    if len(version):
+        data['client_version'] = version
+    if flags & 2: ## wire.DELTA
+        data['delta_since'] = header.getUint32(12, True)
+
+    keys = _schema['keys']
+    scale = _schema['scale']
+    start = _schema['header']
+    if flags & 1: ## wire.RANGES
+        ## (first, length) runs of item indices, then their values
+        values = __new__(Int16Array(buf, start + 8 * nranges, nvalues))
+        runs = __new__(Uint32Array(buf, start, 2 * nranges))
+        n = 0
+        for r in range(nranges):
+            first = runs[2 * r]
+            for i in range(runs[2 * r + 1]):
+                data[keys[first + i]] = values[n] / scale
+                n += 1
+    elif flags & 4: ## wire.BITMAP
+        ## a bit per item, set for those whose values follow
+        values = __new__(Int16Array(buf, start + nranges, nvalues))
+        bits = __new__(Uint8Array(buf, start, nranges))
+        n = 0
+        for i in range(len(keys)):
+            if bits[i >> 3] & (1 << (i & 7)):
+                data[keys[i]] = values[n] / scale
+                n += 1
+    else:
+        values = __new__(Int16Array(buf, start, nvalues))
+        for i in range(nvalues):
+            data[keys[i]] = values[i] / scale
+    return data
+
+def getState():
+    """
+    Fetch JSON obj containing monitored variables. Once we hold a full
+    state, ask only for what changed since our tick count. The virtual
+    list asks only for the rows it has, and in full after a scroll. Once
+    the schema has arrived, the state comes as binary frames instead.
     """
-    Triggered on each readout by 'state:update' custom event. We check each
-    state value and alter it's text color accordingly.
+    global _state_keys
+    params = []
+    since = _state.hasOwnProperty('count')
+    etag = _state_etag
+    keys = visibleKeys()
+    if keys is not None:
+        params.append('keys=' + keys)
+        if keys != _state_keys:
+            _state_keys = keys
+            since = False
+            etag = None
+    if since:
+        params.append('since={}'.format(_state['count']))
+    url = '/getstate'
+    if len(params):
+        url += '?' + '&'.join(params)
+    if _schema is not None:
+        getFrame(url, receiveState, etag)
+    else:
+        getJSON(url, receiveState, etag)
+
+def checkReload():
+    """
+    Reload the page if the server now has a different build of it. State
+    changes, server restarts included, never cause a reload by themselves.
+    """
+    if (_prior_state is not None and
+        _prior_state.hasOwnProperty('client_version')):
+        if _state['client_version'] != _prior_state['client_version']:
+            location.reload(True)
+
+def openStream():
+    """
+    Subscribe to the server's /stream Server-Sent Events endpoint. Each
+    message carries the same JSON object /getstate returns. The browser
+    reconnects on its own after network errors.
+    """
+    source = __new__ (EventSource('/stream'))
+    def onmessage(event):
+        receiveState(JSON.parse(event.data))
+        checkReload()
+    def onerror():
+        console.log("Connection error on /stream, retrying")
+    source.onmessage = onmessage
+    source.onerror = onerror
+    return source
+
+def bindReadouts():
     """
-    ## queue the new values and colora
-    queue = []
+    Find the readout elements and remember which state key each shows, so
+    updates needn't query the DOM. Call again after replacing the body.
+    """
+    global _readouts, _bindings, _shown, _shown_band
+    _readouts = document.querySelectorAll('.readout')
+    _bindings = []
     for el in _readouts:
-        key = el.getAttribute('data-key')
-        value = _state[key]
-        valuef = float(value)
-        if valuef <= 2.0:
-            color = 'deepskyblue'
-        elif valuef >= 8.0:
-            color = 'red'
+        _bindings.append((el, el.getAttribute('data-key')))
+    _shown = {}
+    _shown_band = {}
+
+def setupVirtualList():
+    """
+    Fill the #readouts viewport with just enough row elements to cover it,
+    plus common.overscan rows above and below. On scroll the rows are
+    moved and rebound to other keys rather than created, so the DOM size
+    and the cost of an update don't depend on the number of items.
+    """
+    viewport = document.getElementById('readouts')
+    nrows = Math.ceil(viewport.clientHeight / common.row_height) + 2 * common.overscan
+    for n in range(min(nrows, common.nitems)):
+        el = document.createElement('div')
+        el.className = 'readout'
+        viewport.appendChild(el)
+        _pool.append(el)
+    viewport.addEventListener('scroll', onScroll)
+    layoutRows()
+
+def onScroll():
+    """ Re-lay the rows at most once per animation frame while scrolling. """
+    global _scroll_pending
+    if _scroll_pending:
+        return
+    _scroll_pending = True
+    window.requestAnimationFrame(scrolledRows)
+
+def scrolledRows():
+    global _scroll_pending
+    _scroll_pending = False
+    layoutRows()
+
+def layoutRows():
+    """
+    Bind the row elements to the items that are in view, or nearly, and
+    schedule a fetch of their values once scrolling pauses.
+    """
+    global _first, _bindings, _shown, _shown_band, _fetch_timer
+    viewport = document.getElementById('readouts')
+    first = Math.floor(viewport.scrollTop / common.row_height) - common.overscan
+    first = max(0, min(first, common.nitems - len(_pool)))
+    if first == _first:
+        return
+    _first = first
+    _bindings = []
+    for n, el in enumerate(_pool):
+        key = common.statekeys[first + n]
+        el.style.top = '{}px'.format((first + n) * common.row_height)
+        el.setAttribute('data-key', key)
+        if _state.hasOwnProperty(key):
+            el.textContent = _state[key]
         else:
-            color = 'green'
-        queue.append((el, value, color))
+            el.textContent = '...'
+        _bindings.append((el, key))
+    _shown = {}
+    _shown_band = {}
+    update_readouts()
+    window.clearTimeout(_fetch_timer)
+    _fetch_timer = window.setTimeout(getState, 100)
+
+def visibleKeys():
+    """ ?keys= range of the virtual list's rows, or None if there is no list. """
+    if not len(_pool):
+        return None
+    return '{}-{}'.format(_first, _first + len(_pool) - 1)
 
-    ## write them to the DOM
-    for el, value, color in queue:
+def update_readouts():
+    """
+    Triggered by the 'state:update' custom event. Schedules renderReadouts()
+    for the next animation frame, once, so however many updates arrive
+    before it the DOM is written at most once per frame.
+    """
+    global _frame_pending
+    if _frame_pending:
+        return
+    _frame_pending = True
+    if window.requestAnimationFrame:
+        window.requestAnimationFrame(renderReadouts)
+    else:
+        window.setTimeout(renderReadouts, 16)
+
+def renderReadouts():
+    """
+    Write the current state to the readouts. Only readouts whose value
+    changed since they were last written get new text, and only those
+    whose color band changed get a new style, so unchanged readouts cause
+    no style or layout work at all. The comparison is with what was
+    written rather than with _prior_state, because several states may
+    have arrived since the last frame.
+    """
+    global _frame_pending
+    _frame_pending = False
+    for el, key in _bindings:
+        value = _state[key]
+        if value == _shown[key]:
+            continue
+        _shown[key] = value
         el.textContent = value
-        el.setAttribute('style', "color:{}; font-size:32;".format(color))
+        band = common.readoutBand(float(value))
+        if band != _shown_band[key]:
+            _shown_band[key] = band
+            el.className = common.bandclasses[band]
 
     ## Also update the stepsize input with the current value, but
     ## check that the element does not have focus before doing so
     ## tp prevent update while user is typing.
     inp = document.getElementById('stepinput')
-    if inp != document.activeElement:
-        inp.value = _state['stepsize']
-
+    if (inp is not None and inp != document.activeElement and
+        _state.hasOwnProperty('stepsize')):
+        if inp.value != str(_state['stepsize']):
+            inp.value = _state['stepsize']
 
 def handle_stepchange(event):
     """
@@ -183,15 +437,22 @@ def start ():
     """
     Client-side app execution starts here.
     """
-    ## Create the body content
-    makeBody()
+    ## The page bench/bench_readouts.py serves drives the readouts
+    ## itself instead of running the app.
+    if window.benchReadouts:
+        document.addEventListener('state:update', update_readouts)
+        window.benchReadouts(bindReadouts, receiveState)
+        return
 
-    ## Initialize the readouts
-    global _readouts
-    _readouts = document.querySelectorAll('.readout')
-    for el in _readouts:
-        el.style.fontSize = '12'
+    ## Create the body content, unless the server sent it pre-rendered.
+    if not document.getElementById('setstep'):
+        makeBody()
 
+    ## Initialize the readouts
+    if document.getElementById('readouts'):
+        setupVirtualList()
+    else:
+        bindReadouts()
 
     ## Bind event handler to step change form
     ssform = document.getElementById('setstep')
@@ -200,15 +461,24 @@ def start ():
     ## Bind custom event handler to document
     document.addEventListener('state:update', update_readouts)
 
+    ## A pre-rendered page carries the state it shows.
+    if window.initialState:
+        receiveState(window.initialState)
+
+    ## Prefer server push. Fall back to polling on browsers
+    ## without EventSource. The stream carries every item, so the
+    ## virtual list polls for its rows instead.
+    if window.EventSource and not len(_pool):
+        openStream()
+        return
+
+    ## Polling switches to binary frames once it has the keys.
+    getJSON('/schema', receiveSchema)
+
     ## define polling function
-    global _state, _prior_state
     def update ():
         getState()
-        ## Reload if server has restarted
-        if (_prior_state is not None and
-            _prior_state.hasOwnProperty('server_start_time')):
-            if _state['server_start_time'] > _prior_state['server_start_time']:
-                location.reload(True)
+        checkReload()
 
     ## First update
     update ()
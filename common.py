@@ -9,9 +9,81 @@ Author: Mike Ellis
 Copyright 2017 Ellis & Grant, Inc.
 License: MIT License
 """
+from htmltree.htmltree import *
+
 ## The number of state items to display in the web page.
 nitems = 10
 ## Enumerated names for each item.
 statekeys = ["item{}".format(n) for n in range(nitems)]
 ## Initial step size for random walk
 stepsize = 0.5
+
+## Readouts are shown in a virtual list, which keeps only the rows in
+## view in the DOM, when there are more than virtual_threshold of them.
+## Rows of the virtual list are row_height px tall, and overscan rows
+## above and below the visible ones are kept ready for scrolling.
+virtual_threshold = 1000
+row_height = 40
+overscan = 10
+
+## Media type of the binary state format, see wire.py. Polling clients ask
+## for it with an Accept header.
+wire_type = 'application/x-nppwad-state'
+
+## Class attribute of a readout in each color band, see readoutBand().
+## The colors are set by the page's style sheet.
+bandclasses = ['readout low', 'readout mid', 'readout high']
+
+def readoutBand(value):
+    """ Color band of a readout value: 0 when low, 2 when high, else 1. """
+    if value <= 2.0:
+        return 0
+    elif value >= 8.0:
+        return 2
+    return 1
+
+def readoutClass(value):
+    """
+    Class attribute for a readout showing value, which makes it blue when
+    low, red when high and green in between.
+    """
+    return bandclasses[readoutBand(value)]
+
+def bodyContent():
+    """
+    Return the htmltree element for the page body content, with a 'waiting
+    ...' readout for each of statekeys, or with an empty #readouts viewport
+    for the virtual list if there are too many. The client renders it in
+    makeBody(); the server renders it, with values filled in, when it
+    pre-renders the page.
+    """
+    banner = H1("Nearly Pure Python Web App Demo", style=dict(color='yellow'))
+    projectlink = A('Source Code on GitHub',
+                    href='https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo')
+    subbanner = H2(projectlink)
+
+    header = Div(banner, subbanner, style=dict(text_align='center'))
+
+    if nitems > virtual_threshold:
+        ## An empty viewport; the client fills in the visible rows.
+        spacer = Div(style=dict(height="{}px".format(nitems * row_height)))
+        readouts = [Div(spacer, id='readouts')]
+    else:
+        readouts = []
+        for datakey in statekeys:
+            readouts.append(Div('waiting ...', _class='readout', data_key=datakey))
+
+    stepinput = Label("Step Size",
+                  Input(id='stepinput', type='text', style=dict(margin='1em')),
+                style=dict(color='white'))
+
+    stepsubmit = Input(type="submit", value="Submit")
+
+    stepform = Form(
+                 Div(stepinput, stepsubmit, style=dict(margin='20px')),
+               id='setstep')
+
+    bodycontent = Div(header)
+    bodycontent.C.extend(readouts)
+    bodycontent.C.append(stepform)
+    return bodycontent
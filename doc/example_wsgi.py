@@ -34,4 +34,14 @@ if path not in sys.path:
 # Import the wrapped Bottle app object.
 from server import app_for_wsgi_env as application
 
+# The wrapper builds on the first request and then leaves the sources alone.
+# To also pick up source changes without a restart, have it check them at
+# most every 5 seconds instead:
+#
+# from server import wsgiapp, AppWrapperMiddleware
+# application = AppWrapperMiddleware(wsgiapp, recheck=5)
+#
+# Wrap wsgiapp, the app with its requests counted for /metrics, rather
+# than the bare Bottle app.
+
 
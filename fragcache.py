@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Memoizing render layer over htmltree elements.
+
+HtmlElement.render() walks the whole tree every time it is called. A
+CachedElement keeps the html it rendered and hands it back until the
+element is changed through one of its mutating methods. A change drops
+the cached html of the element and of every CachedElement containing it,
+so rendering the page again redoes only the path from the change up to the
+root. Untouched subtrees, e.g. thousands of readouts, cost one string
+concatenation each.
+
+Build a tree with the usual htmltree functions and convert it with
+cached(), or construct CachedElements directly.
+
+Only server.py uses it, to render index.html; see buildIndexHtml().
+client.py writes its readouts directly instead, and this module has not
+been checked under Transcrypt. Changes are tracked without weak
+references or attribute hooks, so changes made straight to A or C must be
+followed by a call to invalidate().
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+from htmltree.htmltree import HtmlElement
+
+class CachedElement(HtmlElement):
+    """
+    HtmlElement whose render() result is kept until setAttr(),
+    setContent(), append(), extend() or invalidate() is called on it or on
+    an element it contains. The cache holds one rendering, for the indent
+    it was last rendered with.
+    """
+    def __init__(self, tagname, attrs, content):
+        HtmlElement.__init__(self, tagname, attrs, content)
+        self._html = None
+        self._indent = -1
+        self._parents = []
+        self._adopt(content)
+
+    def _adopt(self, content):
+        """ Link the CachedElements in content back to self. """
+        if isinstance(content, list):
+            for c in content:
+                if isinstance(c, CachedElement):
+                    c._parents.append(self)
+
+    def _disown(self, content):
+        if isinstance(content, list):
+            for c in content:
+                if isinstance(c, CachedElement) and self in c._parents:
+                    c._parents.remove(self)
+
+    def invalidate(self):
+        """ Drop the cached html of self and of all elements containing it. """
+        self._html = None
+        for p in self._parents:
+            p.invalidate()
+
+    def setAttr(self, name, value):
+        """ Set attribute name, e.g. 'class' rather than '_class', to value. """
+        if self.A is None:
+            self.A = {}
+        self.A[name] = value
+        self.invalidate()
+
+    def setContent(self, content):
+        """ Replace the content; see HtmlElement for what it may be. """
+        self._disown(self.C)
+        self.C = content
+        self._adopt(content)
+        self.invalidate()
+
+    def append(self, child):
+        self.C.append(child)
+        self._adopt([child])
+        self.invalidate()
+
+    def extend(self, children):
+        self.C.extend(children)
+        self._adopt(children)
+        self.invalidate()
+
+    def render(self, indent=-1):
+        """ Return the cached html, rendering it first if need be. """
+        if self._html is None or self._indent != indent:
+            self._html = HtmlElement.render(self, indent)
+            self._indent = indent
+        return self._html
+
+def cached(element):
+    """
+    Return a CachedElement copy of an htmltree element and everything it
+    contains. CachedElements in the tree are kept, not copied, so a
+    reference to one stays good for later changes. Anything else, e.g. a
+    string, is returned as is.
+    """
+    if isinstance(element, CachedElement) or not isinstance(element, HtmlElement):
+        return element
+    content = element.C
+    if isinstance(content, list):
+        content = [cached(c) for c in content]
+    return CachedElement(element.T, element.A, content)
+
+def descendants(element):
+    """ Return a list of element and all the elements it contains. """
+    found = [element]
+    if isinstance(element.C, list):
+        for c in element.C:
+            if isinstance(c, HtmlElement):
+                found.extend(descendants(c))
+    return found
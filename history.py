@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Tiered time series history of the state values.
+
+The server otherwise holds only the current value of each item, so a trend
+view, or a client joining late, has nothing to look back at. A History
+keeps every item's recent values in rings of fixed size, one per tier:
+
+    tier 0: every tick, for the last 120 ticks
+    tier 1: min, mean and max of each 10 ticks, for the last 600 ticks
+    tier 2: min, mean and max of each 100 ticks, for the last 6000 ticks
+    tier 3: min, mean and max of each 1000 ticks, for the last 60000 ticks
+
+(with the default tiers, i.e. a minute, five minutes, fifty minutes and
+eight hours at two ticks a second). Values are stored as int16 hundredths,
+like wire.py sends them, in one numpy array per tier with a row per tick
+or bucket, so recording a tick is a single row copy, and a bucket is
+rolled up from the tier below, with vector reductions, only when it
+completes. Memory is fixed at 2 bytes per item per row, 1.3 KB per item
+with the default tiers.
+
+The arrays may also be handed in, e.g. mapped from a file by persist.py,
+in which case the History carries on from what they hold. Readers go by
+the tick numbers stored with the rows rather than by any Python side
+bookkeeping, so a process sharing the mapping, such as an mpserve worker,
+can query() the history another process records.
+
+Requires numpy.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## Values are kept as integer multiples of 1/SCALE.
+SCALE = 100
+
+## (ticks per row, rows) of each tier, finest first.
+DEFAULT_TIERS = ((1, 120), (10, 60), (100, 60), (1000, 60))
+
+class Tier:
+    """
+    One resolution of a History: a ring of depth rows, each covering per
+    ticks. data holds one row array per field, the values for tier 0, min,
+    mean and max for the others. ticks holds the last tick each row covers,
+    -1 for rows not written yet, and next is the row to write next.
+    arrays, if given, is (data, ticks) holding an earlier run's rows.
+    """
+    __slots__ = ('per', 'depth', 'data', 'ticks', 'next')
+
+    def __init__(self, per, depth, nitems, fields, arrays=None):
+        self.per = per
+        self.depth = depth
+        if arrays is None:
+            self.data = numpy.zeros((fields, depth, nitems), numpy.int16)
+            self.ticks = numpy.full(depth, -1, numpy.int64)
+        else:
+            self.data, self.ticks = arrays
+        self.next = 0
+        if self.ticks.max() >= 0:
+            self.next = (int(self.ticks.argmax()) + 1) % depth
+
+    def rows(self, first, last):
+        """ Positions of the rows covering any of ticks first to last, oldest first. """
+        order = numpy.argsort(self.ticks, kind='stable')
+        ticks = self.ticks[order]
+        return order[(ticks >= 0) & (ticks >= first) & (ticks - self.per < last)]
+
+    def oldest(self):
+        """ The first tick the tier covers, or None if it is empty. """
+        written = self.ticks[self.ticks >= 0]
+        if not len(written):
+            return None
+        return int(written.min()) - self.per + 1
+
+    def write(self, count, fields):
+        ## Retire the row before overwriting it, for readers in other
+        ## processes, which don't take the lock.
+        self.ticks[self.next] = -1
+        self.data[:, self.next] = fields
+        self.ticks[self.next] = count
+        self.next = (self.next + 1) % self.depth
+
+class History:
+    """
+    History of the values of statekeys. Call record() once per tick, from
+    one thread; query() may be called from any. arrays, if given, is a
+    (data, ticks) pair for each tier, as Tier takes it.
+    Raises: ImportError without numpy, ValueError for tiers that don't
+            start at one tick per row or where a tier's buckets aren't
+            whole numbers of the next finer tier's, held by it.
+    """
+    def __init__(self, statekeys, tiers=DEFAULT_TIERS, arrays=None):
+        if numpy is None:
+            raise ImportError("History requires numpy")
+        if tiers[0][0] != 1:
+            raise ValueError("the first tier must hold every tick")
+        for (finer, depth), (per, _) in zip(tiers, tiers[1:]):
+            if per % finer or per > finer * depth:
+                raise ValueError("tier of {} ticks can't be rolled up from "
+                                 "{} rows of {}".format(per, depth, finer))
+        self.statekeys = statekeys
+        nitems = len(statekeys)
+        if arrays is None:
+            arrays = [None] * len(tiers)
+        self.tiers = [Tier(per, depth, nitems, 1 if n == 0 else 3, arrays[n])
+                      for n, (per, depth) in enumerate(tiers)]
+        self._scaled = numpy.empty(nitems, numpy.float64)
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """ Memory held for the values. """
+        return sum(tier.data.nbytes for tier in self.tiers)
+
+    def record(self, count, values):
+        """
+        Add the values, a sequence of floats in statekeys order, e.g. a
+        state engine's values, for tick count. Counts must increase by one
+        per call.
+        """
+        numpy.multiply(values, SCALE, out=self._scaled)
+        numpy.rint(self._scaled, out=self._scaled)
+        with self._lock:
+            self.tiers[0].write(count, self._scaled)
+        for finer, tier in zip(self.tiers, self.tiers[1:]):
+            if count % tier.per:
+                break
+            self._rollup(finer, tier, count)
+
+    def _rollup(self, finer, tier, count):
+        """ Write the tier's bucket ending at tick count from the finer tier. """
+        rows = finer.rows(count - tier.per + 1, count)
+        if not len(rows):
+            return
+        src = finer.data[:, rows]
+        ## The finer tier's fields are (values,) or (min, mean, max), so
+        ## first, middle and last serve for both.
+        fields = numpy.empty((3, src.shape[2]), numpy.int16)
+        src[0].min(axis=0, out=fields[0])
+        numpy.rint(src[len(src) // 2].mean(axis=0), out=self._scaled)
+        fields[1] = self._scaled
+        src[-1].max(axis=0, out=fields[2])
+        with self._lock:
+            tier.write(count, fields)
+
+    def query(self, indices, first=None, last=None):
+        """
+        Return the history of the items at indices for ticks first to last,
+        inclusive, from the finest tier reaching back to first, or else the
+        one reaching furthest back. Negative first and last count back from
+        the latest tick; None means the start of the finest tier and the
+        latest tick.
+        Returns: dict(resolution=1, ticks=[t, ...], values={key:[v, ...]})
+            or dict(resolution=n, ticks=[t, ...], min={key:[v, ...]},
+                    mean={...}, max={...})
+        where each tick is the last one a row covers and n is the number of
+        ticks per row.
+        """
+        with self._lock:
+            latest = int(self.tiers[0].ticks.max())
+            if latest < 0:
+                return dict(resolution=1, ticks=[], values={})
+            if last is None:
+                last = latest
+            elif last < 0:
+                last += latest
+            if first is None:
+                first = self.tiers[0].oldest()
+            elif first < 0:
+                first += latest
+            ## Fall back on the tier reaching furthest back.
+            reach = None
+            for tier in self.tiers:
+                oldest = tier.oldest()
+                if oldest is None:
+                    continue
+                if reach is None or oldest < reach[0]:
+                    reach = (oldest, tier)
+                if oldest <= first:
+                    break
+            tier = reach[1]
+            rows = tier.rows(first, last)
+            ticks = tier.ticks[rows].tolist()
+            data = tier.data[:, rows][:, :, indices]
+        names = [self.statekeys[i] for i in indices]
+        series = [{name:(column / SCALE).tolist()
+                   for name, column in zip(names, field.T)} for field in data]
+        if len(series) == 1:
+            return dict(resolution=tier.per, ticks=ticks, values=series[0])
+        return dict(resolution=tier.per, ticks=ticks, min=series[0],
+                    mean=series[1], max=series[2])
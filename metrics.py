@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Low overhead counters and latency histograms for /metrics.
+
+A Registry holds Counters and Histograms and renders them in the
+Prometheus text exposition format, so the output of /metrics can be read
+as is or scraped. Recording is a dict lookup and an increment or two under
+a lock. With the registry disabled it is a single attribute check, and
+MetricsMiddleware passes requests straight through to the app.
+
+Histograms keep a count per bucket rather than samples, so memory stays
+fixed however long the server runs; the percentiles a reader computes
+from them are as fine as the buckets.
+
+Each process has its own registry. With mpserve workers, /metrics shows
+the requests of whichever worker answers it.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import time
+import bisect
+import threading
+
+## Upper bounds in seconds of the default histogram buckets, 100 us to 10 s.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def labelText(names, values):
+    """ Render label names and values as {name="value",...}. """
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for v in values)
+    return '{' + ','.join('{}="{}"'.format(n, v) for n, v in zip(names, escaped)) + '}'
+
+def number(value):
+    """ Render a sample value the way the text format expects. """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """ A count per combination of label values, which only goes up. """
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labelvalues=(), n=1):
+        """ Add n to the count for labelvalues, a tuple matching labels. """
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + n
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        return ["{}{} {}".format(self.name, labelText(self.labels, key), number(value))
+                for key, value in values]
+
+class Histogram:
+    """
+    Observations counted into buckets by upper bound, plus their sum, per
+    combination of label values.
+    """
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {} ## label values -> [count per bucket ..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labelvalues=()):
+        """ Count value for labelvalues, a tuple matching labels. """
+        if not self.registry.enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                series = self.series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def lines(self):
+        with self._lock:
+            series = sorted((key, list(counts)) for key, counts in self.series.items())
+        lines = []
+        names = self.labels + ('le',)
+        for key, counts in series:
+            total = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                total += n
+                lines.append("{}_bucket{} {}".format(
+                             self.name, labelText(names, key + (number(bound),)), total))
+            labels = labelText(self.labels, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, number(counts[-1])))
+            lines.append("{}_count{} {}".format(self.name, labels, total))
+        return lines
+
+class Registry:
+    """ The metrics of a process. Set enabled to False to stop recording. """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Return all metrics in the text exposition format. """
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+class MetricsMiddleware:
+    """
+    WSGI middleware counting the requests to app, timing them from the
+    call until the body has been sent and adding up the bytes sent, by the
+    Bottle route that handled them. For a streaming response, e.g.
+    /stream, the time is the life of the connection.
+    """
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+        self.requests = registry.counter('nppwad_requests_total',
+                                         "HTTP requests by route, method and status",
+                                         ('route', 'method', 'status'))
+        self.latency = registry.histogram('nppwad_request_seconds',
+                                          "Time to serve a request, by route",
+                                          ('route',))
+        self.sent = registry.counter('nppwad_response_bytes_total',
+                                     "Response body bytes sent, by route",
+                                     ('route',))
+
+    def __call__(self, environ, start_response):
+        if not self.registry.enabled:
+            return self.app(environ, start_response)
+        t0 = time.perf_counter()
+        status = ['']
+        def start(line, headers, exc_info=None):
+            status[0] = line[:3]
+            return start_response(line, headers, exc_info)
+        body = self.app(environ, start)
+        if isinstance(body, (list, tuple)):
+            self.record(environ, status[0], t0, sum(len(chunk) for chunk in body))
+            return body
+        return MeteredBody(self, environ, status, t0, body)
+
+    def record(self, environ, status, t0, nbytes):
+        route = environ.get('bottle.route')
+        route = 'unrouted' if route is None else route.rule
+        self.requests.inc((route, environ.get('REQUEST_METHOD', ''), status))
+        self.latency.observe(time.perf_counter() - t0, (route,))
+        self.sent.inc((route,), nbytes)
+
+class MeteredBody:
+    """ A response body iterable that reports to its middleware when closed. """
+    def __init__(self, middleware, environ, status, t0, body):
+        self.middleware = middleware
+        self.environ = environ
+        self.status = status
+        self.t0 = t0
+        self.body = body
+        self.nbytes = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.nbytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.middleware.record(self.environ, self.status[0], self.t0,
+                                   self.nbytes)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Multi-process serving with the state kept in shared memory.
+
+Under a plain pre-fork server every worker would import server.py and run
+its own random walk. Here exactly one process, the owner, runs the state
+ticker. After each tick it writes the encoded snapshot (the JSON plus its
+compressed variants, see snapshot.py) into a multiprocessing.shared_memory
+block. The worker processes share one listening socket and serve requests.
+A feed thread in each worker notices new generations in the block and
+installs them as that worker's current snapshot. Every worker then answers
+with the same data, and each copies a snapshot out only once per tick.
+Per-request work stays the same as in single-process mode.
+
+/setstepsize requests are written to a small mailbox in the same block and
+applied by the owner on its next tick. Workers take a lock shared with the
+owner to write it, so concurrent requests never overwrite each other's
+sequence number.
+
+The snapshot is guarded by a sequence lock: the owner makes the generation
+odd while writing and even when done, and readers retry if the generation
+changed under them. The owner only ever writes the generation field of the
+header, never the mailbox next to it.
+
+Workers are started with fork, so this mode needs a POSIX system. Use it
+via server.py --workers N.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import sys
+import time
+import signal
+import socket
+import struct
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from wsgiref.simple_server import WSGIRequestHandler
+
+from snapshot import Snapshot, encodings
+
+## generation, stepsize request sequence, requested stepsize
+HEADER = struct.Struct('<QQd')
+GENERATION = struct.Struct('<Q')
+## count, then byte lengths of etag, json and each of snapshot.encodings
+SLOT = struct.Struct('<Q' + 'I' * (2 + len(encodings)))
+
+## How often worker feed threads look for a new generation, in seconds.
+feed_interval = 0.01
+
+def slotSize(statekeys):
+    """
+    Upper bound on the bytes needed for one snapshot of a state with the
+    given keys. Values are at most 5 characters ("10.0," style), compressed
+    variants are at most about as large as the JSON, and 1 KiB covers the
+    fixed fields.
+    """
+    jsonbound = sum(len(key) + 9 for key in statekeys) + 1024
+    return SLOT.size + 1024 + jsonbound * (1 + len(encodings))
+
+class SharedState:
+    """
+    The shared memory block. Create it in the owner before forking; the
+    workers inherit the mapping and the lock guarding the step size
+    mailbox.
+    """
+    def __init__(self, statekeys):
+        self.capacity = slotSize(statekeys)
+        self.shm = shared_memory.SharedMemory(
+                       create=True, size=HEADER.size + self.capacity)
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, 0, 0, 0.0)
+        self._steplock = multiprocessing.get_context('fork').Lock()
+        ## Reader side bookkeeping, per process.
+        self._seen_generation = 0
+        self._seen_stepreq = 0
+
+    def write(self, snap):
+        """ Owner: publish snap as the new generation. """
+        variants = [snap.variants.get(coding, b"") for coding in encodings]
+        etag = snap.etag.encode('latin-1')
+        parts = [etag, snap.json] + variants
+        if SLOT.size + sum(len(part) for part in parts) > self.capacity:
+            ## Can't happen with the slotSize() bound, but never overrun.
+            variants = [b""] * len(encodings)
+            parts = [etag, snap.json] + variants
+        ## Only the generation, so step size requests landing meanwhile
+        ## aren't overwritten.
+        generation = GENERATION.unpack_from(self.buf, 0)[0] + 1
+        GENERATION.pack_into(self.buf, 0, generation)
+        offset = HEADER.size
+        SLOT.pack_into(self.buf, offset, snap.count,
+                       *[len(part) for part in parts])
+        offset += SLOT.size
+        for part in parts:
+            self.buf[offset:offset + len(part)] = part
+            offset += len(part)
+        GENERATION.pack_into(self.buf, 0, generation + 1)
+
+    def read(self):
+        """
+        Worker: return a Snapshot of the current generation, or None if it
+        is the one returned last time or nothing has been published yet.
+        """
+        while True:
+            generation = GENERATION.unpack_from(self.buf, 0)[0]
+            if generation == self._seen_generation or generation == 0:
+                return None
+            if generation % 2:
+                time.sleep(0.0001) ## owner is mid-write
+                continue
+            fields = SLOT.unpack_from(self.buf, HEADER.size)
+            offset = HEADER.size + SLOT.size
+            parts = []
+            for length in fields[1:]:
+                parts.append(bytes(self.buf[offset:offset + length]))
+                offset += length
+            if GENERATION.unpack_from(self.buf, 0)[0] != generation:
+                continue ## torn read, try again
+            self._seen_generation = generation
+            etag, json = parts[0].decode('latin-1'), parts[1]
+            variants = {coding:data for coding, data
+                        in zip(encodings, parts[2:]) if data}
+            return Snapshot.fromEncoded(fields[0], etag, json, variants)
+
+    def requestStepSize(self, stepsize):
+        """ Worker: ask the owner to change the step size. Last one wins. """
+        with self._steplock:
+            stepseq = struct.unpack_from('<Q', self.buf, 8)[0]
+            struct.pack_into('<Qd', self.buf, 8, stepseq + 1, stepsize)
+
+    def takeStepSize(self):
+        """ Owner: return a step size requested since the last call, or None. """
+        with self._steplock:
+            stepseq, stepsize = struct.unpack_from('<Qd', self.buf, 8)
+        if stepseq == self._seen_stepreq:
+            return None
+        self._seen_stepreq = stepseq
+        return stepsize
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class WorkerFeed(threading.Thread):
+    """
+    Worker thread that installs each new shared snapshot as appmodule's
+    _snapshot and publishes new ticks to its /stream broadcaster.
+    """
+    def __init__(self, appmodule, shared):
+        super().__init__(name='workerfeed', daemon=True)
+        self.appmodule = appmodule
+        self.shared = shared
+
+    def poll(self):
+        """ Install the current generation if it is new. """
+        snap = self.shared.read()
+        if snap is None:
+            return
+        mod = self.appmodule
+        mod._snapshot = snap
+        ## Every generation is a new state version, tick or not.
+        mod._broadcaster.publish(mod._broadcaster.seq + 1,
+                                 mod.sseFrame(snap.json, id=snap.count))
+
+    def prime(self):
+        """ Block until the owner has published something. """
+        while self.appmodule._snapshot is None:
+            self.poll()
+            time.sleep(feed_interval)
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(feed_interval)
+
+def listeningSocket(host, port):
+    """ Bind and listen on (host, port) for the workers to share. """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+def runWorker(appmodule, servername, sock, quiet):
+    """ Worker process body: feed the snapshot, then serve on sock. """
+    try:
+        feed = WorkerFeed(appmodule, appmodule._shared)
+        feed.prime()
+        feed.start()
+        if servername == 'asyncio':
+            import aioserve
+            host, port = sock.getsockname()[:2]
+            aioserve.AsyncHTTPServer(appmodule.wsgiapp, host, port,
+                                     streams={'/stream': appmodule._broadcaster},
+                                     quiet=quiet, sock=sock).run()
+        else:
+            sharedSocketWSGIServer(appmodule, sock, quiet).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def sharedSocketWSGIServer(appmodule, sock, quiet):
+    """
+    Return a threaded wsgiref server for appmodule.wsgiapp that accepts on sock,
+    an already listening socket inherited from the owner process.
+    """
+    class Handler(WSGIRequestHandler):
+        def log_request(self, *args, **kw):
+            if not quiet:
+                WSGIRequestHandler.log_request(self, *args, **kw)
+    srv = appmodule.ThreadingWSGIServer(sock.getsockname()[:2], Handler,
+                                        bind_and_activate=False)
+    srv.socket.close()
+    srv.socket = sock
+    srv.server_name, srv.server_port = sock.getsockname()[:2]
+    srv.setup_environ()
+    srv.set_app(appmodule.wsgiapp)
+    return srv
+
+def serveWorkers(appmodule, nworkers, servername='wsgiref',
+                 host='0.0.0.0', port=8800, quiet=False):
+    """
+    Run appmodule (the server module) with one state owner, this process,
+    and nworkers forked serving processes. Blocks until interrupted.
+
+    servername is 'wsgiref' (threaded) or 'asyncio' for the workers.
+    """
+    ctx = multiprocessing.get_context('fork')
+    shared = SharedState(appmodule.common.statekeys)
+    appmodule._shared = shared
+    sock = listeningSocket(host, port)
+    workers = []
+    try:
+        ## Fork before starting any threads in this process.
+        for n in range(nworkers):
+            proc = ctx.Process(target=runWorker, name='worker{}'.format(n),
+                               args=(appmodule, servername, sock, quiet))
+            proc.start()
+            workers.append(proc)
+        ## Clean up the workers and the block on kill as well as on ^C.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        appmodule.startTicker()
+        print("Serving on http://{}:{}/ with {} {} workers".format(
+              host, port, nworkers, servername), file=sys.stderr)
+        for proc in workers:
+            proc.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in workers:
+            proc.terminate()
+        for proc in workers:
+            proc.join()
+        sock.close()
+        shared.close(unlink=True)
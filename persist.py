@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Memory-mapped state file for fast restarts.
+
+Without it, a restart draws new random values for every item, the tick
+count starts over and the history is gone. A StateFile maps one file
+holding the state engine's value array, the tick count, the step size,
+the server start time and the history tiers, and hands out numpy arrays
+that live in the mapping. The engine walks its values in place and the
+History writes its rows in place, so a tick costs no copying or writing
+beyond updating the count, and the kernel writes the dirty pages back in
+its own time. On startup the file is mapped again and the same arrays are
+simply used where they are, which takes milliseconds however many items
+and hours of history it holds.
+
+    offset  contents
+         0  HEADER: magic, format version, schema id of the state keys,
+            nitems, count, stepsize, server start time, number of tiers
+            and (ticks per row, rows) of each, see history.py
+       512  float64[nitems]  the values, then for each tier
+            int16[fields, rows, nitems]  its data and
+            int64[rows]  the last tick of each row,
+            each padded to a multiple of 64 bytes
+
+A file whose header doesn't match the current keys and tiers is started
+afresh. The data survives the process being killed, but not a crash of
+the machine between write backs; see flush().
+
+Requires numpy.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+
+from stateengine import ArrayEngine, numpy
+from wire import schemaId
+
+MAGIC = b'NPPWSTAT'
+VERSION = 1
+MAX_TIERS = 16
+## magic, version, schema id, nitems, count, stepsize, start time, ntiers,
+## then (per, rows) for each of MAX_TIERS tiers
+HEADER = struct.Struct('<8sIIQqddI' + 'II' * MAX_TIERS)
+## Offsets of the fields updated on every tick.
+COUNT_AT = 24
+STEPSIZE_AT = 32
+DATA_AT = 512
+
+def padded(nbytes):
+    return (nbytes + 63) // 64 * 64
+
+class StateFile:
+    """
+    The state file at path for statekeys and history tiers, created, or
+    replaced if it doesn't match them, with count 0 and the given stepsize.
+    resumed tells whether an earlier run's contents were kept.
+    Raises: ImportError without numpy, OSError if the file can't be
+            opened or sized.
+    """
+    def __init__(self, path, statekeys, tiers, stepsize):
+        if numpy is None:
+            raise ImportError("StateFile requires numpy")
+        if len(tiers) > MAX_TIERS:
+            raise ValueError("at most {} tiers".format(MAX_TIERS))
+        self.path = path
+        self.nitems = nitems = len(statekeys)
+        schema = schemaId(statekeys)
+        flat = [n for tier in tiers for n in tier]
+        flat += [0] * (2 * MAX_TIERS - len(flat))
+
+        ## Lay out the arrays after the header.
+        layout = []
+        offset = DATA_AT
+        layout.append((offset, numpy.float64, (nitems,)))
+        offset += padded(8 * nitems)
+        for n, (per, depth) in enumerate(tiers):
+            shape = (1 if n == 0 else 3, depth, nitems)
+            layout.append((offset, numpy.int16, shape))
+            offset += padded(2 * shape[0] * depth * nitems)
+            layout.append((offset, numpy.int64, (depth,)))
+            offset += padded(8 * depth)
+        size = offset
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            fields = HEADER.unpack(header) if len(header) == HEADER.size else None
+            self.resumed = (fields is not None
+                            and fields[:4] == (MAGIC, VERSION, schema, nitems)
+                            and list(fields[8:]) == flat
+                            and os.fstat(fd).st_size == size)
+            if not self.resumed:
+                if fields is not None:
+                    print("{} doesn't match the current state, starting "
+                          "afresh".format(path), file=sys.stderr)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        arrays = [numpy.ndarray(shape, dtype, self.map, offset)
+                  for offset, dtype, shape in layout]
+        self.values = arrays[0]
+        self.tiers = list(zip(arrays[1::2], arrays[2::2]))
+        if not self.resumed:
+            for data, ticks in self.tiers:
+                ticks.fill(-1)
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, schema, nitems, 0,
+                             stepsize, time.time(), len(tiers), *flat)
+        (_, _, _, _, self.count, self.stepsize, self.start_time,
+         _) = HEADER.unpack_from(self.map)[:8]
+
+    def engine(self):
+        """
+        An ArrayEngine walking the values in the file in place. A new file
+        gets the engine's random initial values.
+        """
+        if not self.resumed:
+            numpy.copyto(self.values, ArrayEngine(self.nitems, self.stepsize).values)
+        return ArrayEngine(self.nitems, self.stepsize, values=self.values)
+
+    def save(self, count, stepsize):
+        """ Record the tick count and step size that go with the values. """
+        struct.pack_into('<q', self.map, COUNT_AT, count)
+        struct.pack_into('<d', self.map, STEPSIZE_AT, stepsize)
+
+    def flush(self):
+        """ Write the mapping back to disk now rather than eventually. """
+        self.map.flush()
@@ -17,109 +17,471 @@ License: MIT License
 ############################################################
 import os
 import sys
+import atexit
 import time
+import re
+import json
+import shutil
 import doctest
-import random
+import inspect
+import threading
 import subprocess
+import socketserver
 import bottle
 import common
+import stateengine
+from broadcast import Broadcaster, sseFrame
+from snapshot import Snapshot, encodeJSON, compressVariants, chooseBody, encodings
+from ticker import Ticker
+from assets import AssetCache, contentHash
+from buildcache import BuildCache, changedSince, toolVersion
+from builder import Builder, Target, BackgroundBuild, importGraph
+from watcher import FileWatcher
+from subscriptions import Projections, subscriptionId, project
+import wire
+import history
+import persist
+from metrics import Registry, MetricsMiddleware, CONTENT_TYPE as METRICS_TYPE
 from traceback import format_exc
+from wsgiref.simple_server import WSGIServer
+from fragcache import cached, descendants
 from htmltree.htmltree import *
 
-## We import client.py so the Bottle reloader will track it for changes
-## It has no use in this module and no side effects other than a small
-## overhead to load it.
-import client
-
 # Create an app instance.
 app = bottle.Bottle()
 request = bottle.request ## the request object accessor
 
+## Request, tick and build instrumentation, served by /metrics. See
+## metrics.py. serve(metrics=False) turns recording off.
+_metrics = Registry()
+
 
 ############################################################
 # Build index.html
 ############################################################
-def buildIndexHtml():
+## The index.html element trees, kept between calls of buildIndexHtml()
+## so that only what changed is rendered again. See fragcache.py.
+_index_page = {}
+_index_lock = threading.Lock()
+
+def buildIndexHtml(snap=None, clientversion=None):
     """
     Create the content index.html file. For the purposes of the demo, we
     create it with an empty body element to be filled in on the client side.
-    Returns: None
+
+    Given snap, a Snapshot, the body content is rendered here instead,
+    showing the values in snap, and snap is inlined in the page as
+    window.initialState. client.py then uses that body and state rather
+    than making its own. See sendPrerendered().
+
+    The script src carries the content hash of client.js, clientversion,
+    so browsers may cache each version of it indefinitely. In the
+    production profile the hash is part of the bundle's name instead. By
+    default the hash is taken from the file built, if it exists.
+    Returns: the html
     Raises:  Nothing
     """
+    if build_profile == 'production':
+        bundle, src = BUNDLE_JS, '/client.{}.js'
+    else:
+        bundle, src = CLIENT_JS, '/client.js?v={}'
+    if clientversion is None and os.path.exists(bundle):
+        with open(bundle, 'rb') as f:
+            clientversion = contentHash(f.read())
+    src = src.format(clientversion) if clientversion else '/client.js'
 
-    style = Style(**{'a:link':dict(color='red'),
-                     'a:visited':dict(color='green'),
-                     'a:hover':dict(color='hotpink'),
-                     'a:active':dict(color='blue'),
-                     })
+    with _index_lock:
+        page = _index_page
+        if not page:
+            rowheight = '{}px'.format(common.row_height)
+            style = Style(**{'a:link':dict(color='red'),
+                             'a:visited':dict(color='green'),
+                             'a:hover':dict(color='hotpink'),
+                             'a:active':dict(color='blue'),
+                             '.readout':{'font-size':'32px'},
+                             '.readout.low':dict(color='deepskyblue'),
+                             '.readout.mid':dict(color='green'),
+                             '.readout.high':dict(color='red'),
+                             '#readouts':{'position':'relative',
+                                          'height':'70vh',
+                                          'overflow-y':'auto'},
+                             '#readouts .readout':{'position':'absolute',
+                                                   'left':'0', 'right':'0',
+                                                   'height':rowheight,
+                                                   'line-height':rowheight,
+                                                   'overflow':'hidden'},
+                             })
 
-    head = Head(style, Script(src='/client.js', charset='UTF-8'))
+            page['script'] = cached(Script(src=src, charset='UTF-8'))
+            head = cached(Head(style, page['script']))
 
-    body = Body("Replace me on the client side",
-                style=dict(background_color='black'))
+            body = Body("Replace me on the client side",
+                        style=dict(background_color='black'))
+            page['doc'] = cached(Html(head, body))
 
-    doc = Html(head, body)
-    return doc.render()
+            ## The pre-rendered variant shares the head.
+            page['initial'] = cached(Script(''))
+            prebody = cached(Body(common.bodyContent(), page['initial'],
+                                  style=dict(background_color='black')))
+            page['readouts'] = {}
+            for el in descendants(prebody):
+                if el.A and 'data-key' in el.A:
+                    page['readouts'][el.A['data-key']] = el
+                elif el.A and el.A.get('id') == 'stepinput':
+                    page['stepinput'] = el
+            page['shown'] = {} ## key -> value the readout shows
+            page['predoc'] = cached(Html(head, prebody))
 
+        if page['script'].A['src'] != src:
+            page['script'].setAttr('src', src)
+        if snap is None:
+            return page['doc'].render()
+
+        state = json.loads(snap.json)
+        shown = page['shown']
+        for key, el in page['readouts'].items():
+            value = state.get(key)
+            if value is not None and value != shown.get(key):
+                el.setContent([str(value)])
+                el.setAttr('class', common.readoutClass(value))
+                shown[key] = value
+        stepsize = str(state.get('stepsize', ''))
+        if page['stepinput'].A.get('value') != stepsize:
+            page['stepinput'].setAttr('value', stepsize)
+        ## The virtual list only shows its first rows at first, so inline
+        ## just those rather than every item.
+        if common.nitems > common.virtual_threshold:
+            initial = encodeJSON(project(state, common.statekeys,
+                                             range(100))).decode('utf-8')
+        else:
+            initial = snap.json.decode('utf-8')
+        ## Keep '</script>' in a string value from ending the element.
+        page['initial'].setContent("window.initialState = {};".format(
+                                   initial.replace('</', '<\\/')))
+        return page['predoc'].render()
 
 ############################################################
 # Routes and callback functions
 # The following routes are defined below:
 #     /client.js
+#     /client.<hash>.js (production profile)
 #     /home (= /index.html = /)
 #     /getstate
+#     /schema
+#     /subscribe
+#     /history
+#     /metrics
+#     /stream
 #     /setstepsize
 ############################################################
 
+## Build outputs, served from memory. See assets.py.
+JS_DIR = '__javascript__'
+CLIENT_JS = JS_DIR + '/client.js'
+INDEX_HTML = '__html__/index.html'
+## Transcrypt's minified output and its source map, and the production
+## bundle made from them by writeBundle().
+CLIENT_MIN_JS = JS_DIR + '/client.min.js'
+CLIENT_MIN_MAP = JS_DIR + '/extra/sourcemap/client.min.js.map'
+BUNDLE_JS = JS_DIR + '/client.bundle.js'
+BUNDLE_MAP = JS_DIR + '/client.bundle.js.map'
+JS_TYPE = 'application/javascript; charset=UTF-8'
+_assets = AssetCache()
+_assets.add('client.js', CLIENT_JS, JS_TYPE)
+_assets.add('index.html', INDEX_HTML, 'text/html; charset=UTF-8')
+
+def sendAsset(name, version=None):
+    """
+    Serve a cached build output, compressed if the client accepts it, or
+    304 if the client already has this version. A request for a versioned
+    URL whose version is current may be cached for a year.
+
+    While a build is running, only copies loaded before it started are
+    served, never a file the build may be halfway through writing.
+
+    Names the current build profile doesn't produce, e.g. the source map
+    in the dev profile, are not found.
+    """
+    if name not in _assets.files:
+        return bottle.HTTPError(404, "{} is not built in the {} profile".format(
+                                name, build_profile))
+    asset = _assets.peek(name)
+    if asset is None:
+        if _build.building:
+            return bottle.HTTPResponse("{} is being built".format(name),
+                                       status=503, **{'Retry-After':'1'})
+        try:
+            asset = _assets.get(name)
+        except OSError:
+            return bottle.HTTPError(404, "{} has not been built".format(name))
+    if version == asset.version:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'no-cache'
+    return sendBytes(asset.data, asset.variants, asset.etag,
+                     asset.content_type, cache_control)
+
+def sendBytes(data, variants, etag, content_type, cache_control='no-cache'):
+    """
+    Respond with data, or one of its compressed variants if the client
+    accepts it, or 304 if the client already has etag.
+    """
+    headers = {'ETag':etag, 'Cache-Control':cache_control,
+               'Vary':'Accept-Encoding'}
+    if request.get_header('If-None-Match') == etag:
+        return bottle.HTTPResponse(status=304, **headers)
+    body, coding = chooseBody(data, variants, request.get_header('Accept-Encoding'))
+    if coding is not None:
+        headers['Content-Encoding'] = coding
+    headers['Content-Type'] = content_type
+    return bottle.HTTPResponse(body, **headers)
+
 @app.route('/client.js')
 def client():
     """
-    Route for serving client.js
+    Route for serving client.js. index.html asks for /client.js?v=<hash>,
+    which may be cached for good as long as the hash is current.
     """
-    root = os.path.abspath("./__javascript__")
-    return bottle.static_file('client.js', root=root)
+    return sendAsset('client.js', version=request.query.get('v'))
+
+@app.route('/client.<version>.js')
+def bundle(version):
+    """
+    Route for the production bundle under its content hashed name. The
+    source map is only named in a SourceMap header, so browsers fetch it
+    only when the developer tools are open.
+    """
+    response = sendAsset('client.js', version=version)
+    if build_profile == 'production' and response.status_code < 400:
+        response.set_header('SourceMap', '/client.{}.js.map'.format(version))
+    return response
+
+@app.route('/client.<version>.js.map')
+def bundleMap(version):
+    """ Route for the source map of the production bundle. """
+    return sendAsset('client.js.map')
 
 @app.route("/")
 @app.route("/index.html")
 @app.route("/home")
 def index():
     """ Serve the home page """
-    root = os.path.abspath("./__html__")
-    return bottle.static_file('index.html', root=root)
+    if serve_prerendered:
+        return sendPrerendered()
+    return sendAsset('index.html')
+
+## Whether / is served by sendPrerendered(). Set by serve(prerender=True).
+serve_prerendered = False
+
+## (key, etag, html, variants) of the last page sendPrerendered() rendered.
+_prerendered = None
+
+def sendPrerendered():
+    """
+    Serve index.html with the readouts already rendered from the current
+    state and that state inlined, so a cold load shows the values before
+    client.js has even been fetched. The page is rendered on demand, at
+    most once per state version and build, and is never cached by the
+    browser.
+    """
+    global _prerendered
+    html_asset = _assets.peek('index.html')
+    js_asset = _assets.peek('client.js')
+    if html_asset is None or js_asset is None:
+        return sendAsset('index.html') ## not built yet
+    snap = currentSnapshot()
+    key = (snap.etag, js_asset.version, build_profile)
+    page = _prerendered
+    if page is None or page[0] != key:
+        html = buildIndexHtml(snap, js_asset.version).encode('utf-8')
+        page = (key, '"{}"'.format(contentHash(html)), html,
+                compressVariants(html))
+        _prerendered = page
+    return sendBytes(page[2], page[3], page[1], html_asset.content_type)
 
 ## Module level variable used to exchange data beteen handlers
 _state = {}
 
+## Which engine stategen() uses to walk the values: 'list', 'array' or 'auto'.
+## See stateengine.py. 'auto' uses the numpy array engine if numpy is installed.
+state_engine = 'auto'
+
+## Seconds between state ticks.
+tick_interval = 0.5
+
 def stategen():
     """
     Initialize each state item with a random float between 0 and 10, then
-    on each next() call, 'walk' the value by a randomly chosen increment. The
-    purpose is to simulate a set of drifting measurements to be displayed
-    and color coded on the client side.
+    on each later next() call, 'walk' the value by a randomly chosen
+    increment. The purpose is to simulate a set of drifting measurements to
+    be displayed and color coded on the client side.
+
+    The walking itself is done by a state engine from stateengine.py. The
+    pacing is done by the caller, normally the ticker started by
+    startTicker().
+
+    With a state file, see useStateFile(), the values, count and stepsize
+    carry on from where the last run using it stopped.
     """
-    last = time.time()
     counter = 0
-    nitems = common.nitems
+    stepsize = common.stepsize
     statekeys = common.statekeys
-    _state['step'] = (-common.stepsize, 0.0, common.stepsize)
-    _state['stepsize'] = common.stepsize
-    statevalues = [round(random.random()*10, 2) for n in range(nitems)]
-    _state.update(dict(zip(statekeys, statevalues)))
+    if _statefile is None:
+        engine = stateengine.makeEngine(state_engine, common.nitems, stepsize)
+    else:
+        engine = _statefile.engine()
+        counter = _statefile.count
+        stepsize = _statefile.stepsize
+    _state['step'] = (-stepsize, 0.0, stepsize)
+    _state['stepsize'] = stepsize
+    _state.update(zip(statekeys, engine.tolist()))
+    if counter:
+        _state['count'] = counter
+    elif _history is not None:
+        _history.record(counter, engine.values)
+    yield
     while True:
-        ## Update no more frequently than twice per second
-        now = time.time()
-        if now - last >= 0.5:
-            last = now
-            counter += 1
-            step = _state['step']
-            statevalues = [round(v + random.choice(step), 2) for v in statevalues]
-            statevalues = [min(10.0, max(0.0, v)) for v in statevalues]
-            _state.update(dict(zip(statekeys, statevalues)))
-            _state['count'] = counter
+        counter += 1
+        engine.stepsize = _state['stepsize']
+        _changes.record(counter, engine.step())
+        _state.update(zip(statekeys, engine.tolist()))
+        _state['count'] = counter
+        if _statefile is not None:
+            _statefile.save(counter, engine.stepsize)
+        if _history is not None:
+            _history.record(counter, engine.values)
         yield
 
+## Which items changed on recent ticks, for delta responses from /getstate.
+## 120 ticks covers a client that has been away for a minute.
+_changes = stateengine.ChangeRing(120)
+
+## Past values for /history, see history.py. None without numpy.
+_history = history.History(common.statekeys) if history.numpy else None
+
+## Most items one /history request may ask for.
+history_max_keys = 1000
+
+## The file the values and the history are mapped from, if any. See
+## useStateFile().
+_statefile = None
+
+def useStateFile(path):
+    """
+    Keep the state engine's values, the count, the stepsize and the history
+    in the file at path, see persist.py, and resume from it if an earlier
+    run left a matching one there. Call before the ticker starts. Implies
+    the array state engine.
+    Raises: ImportError without numpy.
+    """
+    global _statefile, _history
+    t0 = time.perf_counter()
+    _statefile = persist.StateFile(path, common.statekeys,
+                                   history.DEFAULT_TIERS, common.stepsize)
+    _history = history.History(common.statekeys, arrays=_statefile.tiers)
+    atexit.register(_statefile.flush)
+    if _statefile.resumed:
+        print("Resumed at tick {} from {} in {:.1f} ms".format(
+              _statefile.count, path, (time.perf_counter() - t0) * 1e3),
+              file=sys.stderr)
+
 ## The generator needs to persist outside of handlers.
 _stateg = stategen()
+## Guards _state, _stateg and _changes between the ticker and handlers.
+_stateg_lock = threading.Lock()
+
+## Per key set views of the state for /getstate?keys= and ?sub=. See
+## subscriptions.py.
+_projections = Projections(common.statekeys)
+
+## Fans out each new state, serialized once, to the /stream subscribers.
+_broadcaster = Broadcaster()
+
+## The current state, pre-encoded. See snapshot.py. Replaced, never
+## modified, whenever the state version (stateETag) changes.
+_snapshot = None
+
+## The background thread advancing the state, see startTicker().
+_ticker = None
+
+## In multi-worker mode (see mpserve.py) the shared memory block linking the
+## state owner process, which ticks and writes to it, with the worker
+## processes, which serve requests from it. None otherwise.
+_shared = None
+
+def publishState():
+    """
+    Encode the current state into a new _snapshot if its version changed,
+    and publish it to stream subscribers as an SSE frame. A step size or
+    client version change is a new version too, so subscribers see it
+    without waiting for the next tick. Call with _stateg_lock held.
+    """
+    global _snapshot
+    etag = stateETag()
+    if _snapshot is None or _snapshot.etag != etag:
+        _snapshot = Snapshot(_state, etag)
+        if _shared is not None:
+            _shared.write(_snapshot)
+        _broadcaster.publish(_broadcaster.seq + 1,
+                             sseFrame(_snapshot.json, id=_snapshot.count))
+
+_tick_phase = _metrics.histogram('nppwad_tick_phase_seconds',
+                                  "Time to step the state engine, publish "
+                                  "the new state and refresh the views "
+                                  "clients poll", ('phase',))
+_tick_seconds = _metrics.histogram('nppwad_tick_seconds', "Time a tick took")
+_tick_late = _metrics.histogram('nppwad_tick_late_seconds',
+                                "How far past its deadline a tick started")
+_ticks_skipped = _metrics.counter('nppwad_ticks_skipped_total',
+                                  "Ticks skipped because the one before overran")
+
+def tickState():
+    """ Advance the simulation by one tick and publish the result. """
+    with _stateg_lock:
+        if _shared is not None:
+            stepsize = _shared.takeStepSize()
+            if stepsize is not None:
+                _state['stepsize'] = stepsize
+                _state['step'] = (-stepsize, 0, stepsize)
+        t0 = time.perf_counter()
+        next(_stateg)
+        t1 = time.perf_counter()
+        publishState()
+        t2 = time.perf_counter()
+    _tick_phase.observe(t1 - t0, ('step',))
+    _tick_phase.observe(t2 - t1, ('publish',))
+    ## Handlers may run again while the views are encoded.
+    if _projections.pending():
+        _projections.refresh(*publishedState())
+        _tick_phase.observe(time.perf_counter() - t2, ('views',))
+
+def observeTick(late, seconds, missed):
+    """ Ticker callback recording the timing of each tick. """
+    _tick_seconds.observe(seconds)
+    _tick_late.observe(late)
+    if missed:
+        _ticks_skipped.inc(n=missed)
+
+def startTicker():
+    """
+    Initialize and publish the state, then start the thread that calls
+    tickState() every tick_interval seconds. Safe to call more than once.
+    """
+    global _ticker
+    with _stateg_lock:
+        if _ticker is not None:
+            return
+        next(_stateg) ## first call just initializes the values
+        publishState()
+        _ticker = Ticker(tick_interval, tickState, name='stateticker',
+                         observe=observeTick)
+        _ticker.start()
+
+def currentSnapshot():
+    """ Return the latest snapshot, starting the ticker if need be. """
+    if _snapshot is None:
+        startTicker()
+    return _snapshot
 
 @app.route("/getstate")
 def getstate():
@@ -127,9 +489,312 @@ def getstate():
     Serve a JSON object representing state values.
     Returns: dict(count=n, item0=v0, item1=v1, ...)
     Raises:  Nothing
+
+    The full state is written straight from the current pre-encoded
+    snapshot, compressed if the client accepts gzip or br.
+
+    With ?since=n, where n is a count the client already holds, returns only
+    the items that changed after tick n, marked with delta_since=n:
+        dict(delta_since=n, count=m, stepsize=s, itemK=vK, ...)
+    The full state is returned instead when tick n is no longer in the
+    change ring, or when it would be no larger than the delta as sent.
+    The delta since the previous tick is encoded and compressed once per
+    state version.
+
+    With ?keys=spec, e.g. keys=100-149, returns only the items whose indices
+    in common.statekeys spec names, see subscriptions.parseKeys(), plus
+    count, stepsize, server_start_time and client_version. ?sub=id, with an
+    id from /subscribe, does the same for the key set it was issued for.
+    since may be combined with either.
+
+    A client sending Accept: application/x-nppwad-state gets any of the
+    above as a binary wire.Frame instead, see wire.py and /schema.
+
+    Responses carry an ETag for the current tick. A client that sends it
+    back in If-None-Match before the next tick gets an empty 304.
+    """
+    snap = currentSnapshot()
+    binary = wire.accepts(request.get_header('Accept'))
+    etag = binaryETag(snap.etag) if binary else snap.etag
+    bottle.response.set_header('ETag', etag)
+    bottle.response.set_header('Cache-Control', 'no-cache')
+    bottle.response.set_header('Vary', 'Accept, Accept-Encoding')
+    if request.get_header('If-None-Match') == etag:
+        return bottle.HTTPResponse(status=304, ETag=etag)
+    since = request.query.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            since = None
+    keys = request.query.get('keys')
+    sub = request.query.get('sub')
+    if keys is not None or sub is not None:
+        found = _projections.lookup(keys, sub)
+        if found is None:
+            return bottle.HTTPError(400, "keys must look like 0-99,250")
+        return sendView(snap, found, since, binary)
+    if binary:
+        ## Frames of the whole state are the view of every key.
+        found = _projections.lookup('0-{}'.format(len(common.statekeys) - 1))
+        return sendView(snap, found, since, binary)
+    if since is not None:
+        delta = stateDelta(since)
+        if delta is not None:
+            return sendSmaller(delta, snap)
+    return sendSnapshot(snap)
+
+def sendSnapshot(snap):
+    """
+    Return the body of snap, a Snapshot or a wire.Frame, in the best
+    encoding the request accepts.
+    """
+    body, coding = snap.body(request.get_header('Accept-Encoding'))
+    if isinstance(snap, wire.Frame):
+        bottle.response.content_type = wire.CONTENT_TYPE
+    else:
+        bottle.response.content_type = 'application/json'
+    if coding is not None:
+        bottle.response.set_header('Content-Encoding', coding)
+    return body
+
+def stateETag():
+    """
+    Return an ETag naming the current state version. The server start time
+    is included so a restarted server never matches a stale tag, and the
+    client version so a rebuild is noticed before the next tick.
+    """
+    return '"{}-{}-{}-{}"'.format(_state.get('server_start_time', 0),
+                                  _state.get('count', 0), _state['stepsize'],
+                                  _state.get('client_version', ''))
+
+## stateDelta() for since = count - 1, what a client polling every tick
+## asks for, encoded once per state version: (etag, Snapshot) or None.
+_tick_delta = None
+
+def stateDelta(since):
+    """
+    Return a Snapshot of the delta response for getstate(), or None if
+    since isn't covered by _changes.
+    """
+    global _tick_delta
+    etag, values, changed = publishedState()
+    count = values.get('count', 0)
+    if since == count - 1 and changed is not None:
+        cached = _tick_delta
+        if cached is None or cached[0] != etag:
+            cached = _tick_delta = (etag, Snapshot(deltaValues(values, changed,
+                                                               since), etag))
+        return cached[1]
+    with _stateg_lock:
+        changed = _changes.changedSince(since, count)
+    if changed is None:
+        return None
+    return Snapshot(deltaValues(values, changed, since), etag)
+
+def deltaValues(values, changed, since):
+    """ The delta object for the items at indices changed of state values. """
+    statekeys = common.statekeys
+    delta = {statekeys[i]:values[statekeys[i]] for i in changed}
+    delta['delta_since'] = since
+    delta['count'] = values.get('count', 0)
+    delta['stepsize'] = values['stepsize']
+    if 'client_version' in values:
+        delta['client_version'] = values['client_version']
+    return delta
+
+def sendSmaller(delta, full):
+    """
+    Send delta, or full, a Snapshot or Frame of the same state version,
+    instead if it is no larger in the encoding the request accepts. A
+    delta of most items doesn't compress as well as the whole state.
+    """
+    accept = request.get_header('Accept-Encoding')
+    if len(delta.body(accept)[0]) >= len(full.body(accept)[0]):
+        return sendSnapshot(full)
+    return sendSnapshot(delta)
+
+def binaryETag(etag):
+    """ The ETag of the wire.Frame form of the state version etag. """
+    return etag[:-1] + '-bin"'
+
+## lastTickChanges() result for the tick it was last called on: (count,
+## indices) or None.
+_last_changes = None
+
+def lastTickChanges():
+    """
+    The indices of the items the last tick changed, or None if unknown.
+    Call with _stateg_lock held.
+    """
+    global _last_changes
+    count = _state.get('count', 0)
+    if _last_changes is None or _last_changes[0] != count:
+        _last_changes = (count, _changes.changedSince(count - 1, count))
+    return _last_changes[1]
+
+## publishedState() for the state version it was last called on.
+_published = None
+
+def publishedState():
+    """
+    Return (etag, values, changed) for the current state version, for
+    encoding views and deltas without holding _stateg_lock: a copy of
+    _state, made at most once per version, and lastTickChanges(). Worker
+    processes, which have no _state, parse the values from the snapshot
+    and have no changed list.
+    """
+    global _published
+    snap = currentSnapshot()
+    published = _published
+    if published is not None and published[0] == snap.etag:
+        return published
+    if _shared is not None:
+        published = (snap.etag, json.loads(snap.json), None)
+    else:
+        with _stateg_lock:
+            published = (stateETag(), dict(_state), lastTickChanges())
+    _published = published
+    return published
+
+def sendView(snap, found, since=None, binary=False):
+    """
+    Return the response for getstate() with ?keys= or ?sub=: the view of
+    the key set found, (canonical, indices) from _projections.lookup(), or
+    with since only those of its items that changed after tick since,
+    marked with delta_since as in stateDelta(). With binary, as a
+    wire.Frame.
+    """
+    canonical, indices = found
+    etag, values, changed = publishedState()
+    full, delta = _projections.encoded(canonical, indices, etag, values,
+                                       changed, binary)
+    if since is None or _shared is not None:
+        ## Workers have no change ring to make other deltas from.
+        return sendSnapshot(full)
+    ## The usual case, a client polling every tick, is precomputed.
+    if delta is not None and since == full.count - 1:
+        return sendSmaller(delta, full)
+    with _stateg_lock:
+        changed = _changes.changedSince(since, full.count)
+    if changed is None:
+        return sendSnapshot(full)
+    changed = set(changed)
+    changed = [i for i in indices if i in changed]
+    if binary:
+        return sendSmaller(wire.Frame(values, full.etag, common.statekeys,
+                                      _projections.schema, changed, since), full)
+    subset = project(values, common.statekeys, changed)
+    subset['delta_since'] = since
+    return sendSmaller(Snapshot(subset, full.etag), full)
+
+## The /schema response, encoded on first use: (body, variants, etag).
+_schema = None
+
+@app.route("/schema")
+def getschema():
+    """
+    The state keys, sent once to clients of the binary format instead of
+    in every response, see wire.py:
+        dict(schema=id, keys=[key0, key1, ...], scale=100, header=56)
+    """
+    global _schema
+    if _schema is None:
+        body = encodeJSON(wire.schema(common.statekeys))
+        _schema = (body, compressVariants(body, level='max'),
+                   '"{}"'.format(_projections.schema))
+    return sendBytes(*_schema, content_type='application/json')
+
+@app.route("/subscribe", method=['GET', 'POST'])
+def subscribe():
+    """
+    Register the key set given as keys, e.g. keys=100-149, see
+    subscriptions.parseKeys(), and return its subscription id:
+        dict(sub=id, keys=canonical key set, nkeys=number of items)
+    Pass the id to /getstate as ?sub=id. Clients subscribing to the same
+    items get the same id and share one precomputed view of the state.
+    """
+    keys = request.params.get('keys')
+    found = None if keys is None else _projections.lookup(keys)
+    if found is None:
+        return bottle.HTTPError(400, "keys must look like 0-99,250")
+    canonical, indices = found
+    _projections.register(canonical, indices, subscribe=True)
+    return dict(sub=subscriptionId(canonical), keys=canonical,
+                nkeys=len(indices))
+
+@app.route("/history")
+def gethistory():
+    """
+    Serve the recent history of the items in ?keys=, a key set as for
+    /getstate, for ticks ?from= to ?to=, both optional and inclusive.
+    Negative ticks count back from the current one, so from=-600 asks for
+    the last five minutes. Recent ticks come one per tick, older ones as
+    min, mean and max per bucket of ticks; see History.query() for the
+    returned object.
     """
-    next(_stateg)
-    return _state
+    if _history is None:
+        return bottle.HTTPError(501, "history needs numpy")
+    if _shared is not None and _statefile is None:
+        ## Workers only see the owner's history through the state file.
+        return bottle.HTTPError(501, "history is kept by the state owner, "
+                                "use --state-file to share it with workers")
+    found = _projections.lookup(request.query.get('keys', ''))
+    if found is None:
+        return bottle.HTTPError(400, "keys must look like 0-99,250")
+    canonical, indices = found
+    if len(indices) > history_max_keys:
+        return bottle.HTTPError(400, "at most {} keys".format(history_max_keys))
+    try:
+        span = [int(request.query[name]) if name in request.query else None
+                for name in ('from', 'to')]
+    except ValueError:
+        return bottle.HTTPError(400, "from and to must be tick counts")
+    currentSnapshot()
+    bottle.response.set_header('Cache-Control', 'no-cache')
+    return _history.query(indices, *span)
+
+@app.route("/metrics")
+def getmetrics():
+    """
+    Request counts, latency histograms and bytes sent per route, tick and
+    build timings and build cache hits, as Prometheus style text; see
+    metrics.py. Each process counts its own, so with workers, see
+    mpserve.py, this is one worker's requests and the owner's ticks go
+    uncounted here.
+    """
+    if not _metrics.enabled:
+        return bottle.HTTPError(404, "metrics are turned off")
+    bottle.response.content_type = METRICS_TYPE
+    bottle.response.set_header('Cache-Control', 'no-cache')
+    return _metrics.render()
+
+@app.route("/stream")
+def stream():
+    """
+    Server-Sent Events endpoint. Pushes the full state as a JSON 'message'
+    event on every tick and step size change, i.e. the same object
+    /getstate returns. Each connection holds a server thread, so use a
+    threaded server (the default wsgiref server is made threaded by
+    serve()).
+    """
+    currentSnapshot()
+    bottle.response.content_type = 'text/event-stream'
+    bottle.response.set_header('Cache-Control', 'no-cache')
+    def events():
+        _broadcaster.subscribe()
+        try:
+            ## Tell the browser how long to wait before reconnecting.
+            yield b"retry: 2000\n\n"
+            seq = -1
+            while True:
+                seq, frame = _broadcaster.wait(seq, timeout=15)
+                if frame is None:
+                    frame = b": keepalive\n\n" ## SSE comment
+                yield frame
+        finally:
+            _broadcaster.unsubscribe()
+    return events()
 
 @app.post("/setstepsize")
 def setStepSize():
@@ -140,90 +805,440 @@ def setStepSize():
     against exploits.
     """
     stepsize = float(request.forms.get('stepsize'))
-    _state['stepsize'] = stepsize
-    _state['step'] = (-stepsize, 0, stepsize)
+    if _shared is not None:
+        ## A worker process; the owner applies it on the next tick.
+        _shared.requestStepSize(stepsize)
+        return {}
+    with _stateg_lock:
+        _state['stepsize'] = stepsize
+        _state['step'] = (-stepsize, 0, stepsize)
+        if _ticker is not None:
+            publishState()
     return {}
 
 ########################################################
 # Build functions
 ########################################################
 
-def needsBuild(target, sources):
+## Transcrypt outputs, keyed on source contents. See buildcache.py.
+_buildcache = BuildCache('__buildcache__')
+
+## Build profiles: how Transcrypt is run and what /client.js serves, see
+## useProfile(). 'dev' ships Transcrypt's readable output. 'production'
+## also minifies (Transcrypt runs the Closure Compiler, which needs Java)
+## and uses Transcrypt's tiny runtime, which leaves out operator
+## overloading support that client.py doesn't use anyway.
+TRANSCRYPT_FLAGS = {'dev':'-b -n -m', 'production':'-b -m -xt'}
+build_profile = 'dev'
+
+_transcrypt_cache = _metrics.counter('nppwad_transcrypt_cache_total',
+                                     "Transcrypt runs found in the build "
+                                     "cache, or not", ('result',))
+
+def transcryptKey(sources, flags):
+    """ Build cache key for running Transcrypt with flags on sources. """
+    return _buildcache.key(sources, salt='transcrypt {} {}'.format(
+                           toolVersion('transcrypt'), flags))
+
+def transcrypt(module, sources, flags=TRANSCRYPT_FLAGS['dev']):
+    """
+    Compile module, e.g. 'client.py', to JS in JS_DIR, unless the build
+    cache holds the outputs of an earlier build from identical sources,
+    flags and Transcrypt version. Reports the hit or miss on stderr.
+    Raises:  Exception if Transcrypt fails.
+    """
+    name = os.path.splitext(os.path.basename(module))[0]
+    key = transcryptKey(sources, flags)
+    meta = _buildcache.restore(key, JS_DIR)
+    _transcrypt_cache.inc(('miss' if meta is None else 'hit',))
+    if meta is not None:
+        print("{}.js: build cache hit, restored in {:.3f}s, saved {:.1f}s".format(
+              name, meta['restore_seconds'], meta['seconds']), file=sys.stderr)
+        return
+    t0 = time.time()
+    proc = subprocess.Popen('transcrypt {} {}'.format(flags, module), shell=True)
+    if proc.wait() != 0:
+        raise Exception("Failed trying to build {}.js".format(name))
+    seconds = time.time() - t0
+    _buildcache.store(key, JS_DIR, changedSince(JS_DIR, t0 - 1, name + '.'),
+                      seconds)
+    print("{}.js: build cache miss, built in {:.1f}s".format(name, seconds),
+          file=sys.stderr)
+
+def writeIndexHtml(inputs):
+    """ Build action for index.html. """
+    os.makedirs(os.path.dirname(INDEX_HTML), exist_ok=True)
+    with open(INDEX_HTML, 'w') as f:
+        print(buildIndexHtml(),file=f)
+
+def writeBundle(inputs):
+    """
+    Build action for the production bundle: Transcrypt's minified output
+    minus its sourceMappingURL comment, with the source map copied next
+    to it. Prints sizeReport().
+    """
+    with open(CLIENT_MIN_JS, 'rb') as f:
+        js = f.read()
+    js = re.sub(rb'\n?//# sourceMappingURL=\S*\s*$', b'\n', js)
+    with open(BUNDLE_JS, 'wb') as f:
+        f.write(js)
+    if os.path.exists(CLIENT_MIN_MAP):
+        shutil.copyfile(CLIENT_MIN_MAP, BUNDLE_MAP)
+    print(sizeReport(), file=sys.stderr)
+
+def sizeReport():
+    """
+    Return a table comparing the dev and production client.js sizes, plain
+    and compressed as they would be sent. The dev build is taken from the
+    build cache; failing that, Transcrypt's unminified output from the
+    production build stands in for it.
+    """
+    dev = os.path.join(_buildcache.root,
+                       transcryptKey(importGraph('client.py'),
+                                     TRANSCRYPT_FLAGS['dev']),
+                       'files', 'client.js')
+    rows = [('dev', dev) if os.path.exists(dev) else ('unminified', CLIENT_JS),
+            ('production', BUNDLE_JS)]
+    sizes = []
+    for label, path in rows:
+        with open(path, 'rb') as f:
+            data = f.read()
+        variants = compressVariants(data, level='max')
+        sizes.append([len(data)] + [len(variants.get(coding, data))
+                                    for coding in encodings])
+    row = "  {:<21}" + " {:>10}" * (1 + len(encodings))
+    lines = [row.format('client.js bytes', 'plain', *encodings)]
+    for (label, path), size in zip(rows, sizes):
+        lines.append(row.format(label, *size))
+    lines.append(row.format('production/' + rows[0][0],
+                 *["{:.0%}".format(p / d) for p, d in zip(sizes[1], sizes[0])]))
+    return '\n'.join(lines)
+
+## What doBuild() builds, set up by useProfile(). client.js is compiled
+## from client.py and whatever it imports. index.html depends only on the
+## code that renders it and on the bundle, whose hash it embeds, not on
+## the whole of server.py.
+_builder = Builder(os.path.join('__buildcache__', 'manifest.json'))
+
+_build_seconds = _metrics.histogram('nppwad_build_seconds',
+                                    "Time doBuild() took", ('result',))
+_target_seconds = _metrics.histogram('nppwad_build_target_seconds',
+                                     "Time each build target's action took",
+                                     ('target',))
+_targets = _metrics.counter('nppwad_build_targets_total',
+                            "Build targets looked at, by outcome",
+                            ('target', 'outcome'))
+
+def observeTarget(name, outcome, seconds):
+    """ Builder callback recording what happened to each target. """
+    _targets.inc((name, outcome))
+    if outcome != 'uptodate':
+        _target_seconds.observe(seconds, (name,))
+
+_builder.observe = observeTarget
+
+def useProfile(profile):
     """
-    Returns True if target doesn't exist or is older than any of the sources.
-    Sources must be an iterable, e.g. list or tuple.
+    Select the build profile, 'dev' or 'production', for the following
+    builds and for what /client.js serves.
+
+    The production profile adds the bundle.js target, see writeBundle(),
+    and index.html loads it as /client.<hash>.js, which may be cached for
+    good. Switching profiles rebuilds client.js, though usually straight
+    from the build cache.
     """
-    return not os.path.exists(target) or any([(os.stat(target).st_mtime
-              < os.stat(source).st_mtime) for source in sources])
+    global build_profile
+    build_profile = profile
+    production = profile == 'production'
+    flags = TRANSCRYPT_FLAGS[profile]
+    _builder.targets.clear()
+    _builder.add(Target('client.js',
+                        [CLIENT_JS, CLIENT_MIN_JS] if production else [CLIENT_JS],
+                        inputs=lambda: importGraph('client.py'),
+                        action=lambda inputs: transcrypt('client.py', inputs, flags),
+                        extra=lambda: flags))
+    if production:
+        _builder.add(Target('bundle.js', [BUNDLE_JS],
+                            inputs=lambda: [],
+                            action=writeBundle,
+                            deps=['client.js'],
+                            extra=lambda: inspect.getsource(writeBundle)))
+    _builder.add(Target('index.html', [INDEX_HTML],
+                        inputs=lambda: [sys.modules[Html.__module__].__file__],
+                        action=writeIndexHtml,
+                        deps=['bundle.js' if production else 'client.js'],
+                        extra=lambda: profile + inspect.getsource(buildIndexHtml)))
+    _assets.add('client.js', BUNDLE_JS if production else CLIENT_JS, JS_TYPE)
+    if production:
+        _assets.add('client.js.map', BUNDLE_MAP, 'application/json')
+
+useProfile('dev')
+
 def doBuild():
     """
-    Build the html and js files, if needed.
+    Build the html and js files, if needed, and reload the in-memory copies
+    of any that were rebuilt. See builder.py. If the build fails, the copies
+    are left alone and the old versions go on being served.
+    Returns: list of the targets that were rebuilt.
+    """
+    t0 = time.perf_counter()
+    try:
+        built = _builder.build()
+    except Exception:
+        _build_seconds.observe(time.perf_counter() - t0, ('failed',))
+        raise
+    _assets.refresh(built)
+    updateClientVersion()
+    _build_seconds.observe(time.perf_counter() - t0, ('ok',))
+    return built
+
+def updateClientVersion():
+    """
+    Put the content hash of index.html, which embeds that of client.js, in
+    the state as client_version. Open pages reload when it changes, and
+    only then; see checkReload() in client.py.
+    """
+    asset = _assets.peek('index.html')
+    if asset is None:
+        return
+    with _stateg_lock:
+        if _state.get('client_version') == asset.version:
+            return
+        _state['client_version'] = asset.version
+        if _ticker is not None:
+            publishState()
+
+## Runs doBuild() off the request path.
+_build = BackgroundBuild(doBuild, name='doBuild')
+
+def startBuild():
+    """
+    Load the outputs of the last build as they are now, then start
+    doBuild() in the background without waiting for it. Requests keep
+    getting the loaded copies until the build succeeds and replaces them.
+    Failures are printed and kept in _build.error.
+
+    client_version is set from the loaded index.html first, so pages don't
+    see it appear, and reload, only when the build finishes.
+    """
+    _assets.preload()
+    updateClientVersion()
+    _build.request()
+
+## Watches the build inputs while serving, see watchSources().
+_watcher = None
+
+def serverSources():
+    """
+    The Python sources of the modules this process has loaded, this file,
+    common.py and htmltree among them. Changing one needs a restart.
+    """
+    files = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path and path.endswith('.py'):
+            files.add(os.path.abspath(path))
+    return files
 
-    Note: In larger projects with more complex dependencies, you'll probably
-    want to use make or scons to build the targets instead of the simple
-    approach taken here.
+def sourceFiles():
+    """
+    The files watchSources() watches: all build inputs and the server's own
+    modules from this directory.
     """
-    ## build the index.html file
-    index_sources = ('server.py', 'htmltree/htmltree.py', 'common.py')
-    target = '__html__/index.html'
-    if needsBuild(target, index_sources):
-        os.makedirs(os.path.dirname(target), exist_ok=True)
-        with open(target, 'w') as f:
-            print(buildIndexHtml(),file=f)
+    here = os.path.dirname(os.path.abspath(__file__)) + os.sep
+    files = {path for path in serverSources() if path.startswith(here)}
+    for target in _builder.targets.values():
+        files.update(os.path.abspath(path) for path in target.inputs())
+    return files
 
-    ## build the client.js file
-    client_sources = ('client.py', 'htmltree/htmltree.py', 'common.py')
-    if needsBuild('__javascript__/client.js', client_sources):
-        proc = subprocess.Popen('transcrypt -b -n -m client.py', shell=True)
-        if proc.wait() != 0:
-            raise Exception("Failed trying to build client.js")
+def sourcesChanged(paths):
+    """
+    FileWatcher callback. Starts a background build, which redoes only the
+    targets whose inputs changed. The server keeps its state and its
+    connections; open pages reload only if the build changes what they
+    run.
+
+    A change to a module the server itself runs, e.g. common.py, can't be
+    applied in place, so the process restarts itself instead; see
+    restartServer(). The restarted server builds the client from the
+    changed sources.
+    """
+    stale = paths & serverSources()
+    if stale:
+        print("Changed: {}, restarting".format(
+              ', '.join(sorted(os.path.relpath(path) for path in stale))),
+              file=sys.stderr)
+        restartServer()
+    if paths:
+        print("Changed: {}, rebuilding".format(
+              ', '.join(sorted(os.path.relpath(path) for path in paths))),
+              file=sys.stderr)
+        startBuild()
+
+def restartServer():
+    """
+    Replace this process with a fresh run of the same command line. The
+    state file, if any, is saved first so the new process resumes from it;
+    without one the state starts over. Open pages reconnect and reload.
+    Returns: never
+    """
+    if _statefile is not None:
+        _statefile.flush()
+    sys.stderr.flush()
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+def watchSources(interval=1.0):
+    """ Start rebuilding on source changes. Safe to call more than once. """
+    global _watcher
+    if _watcher is None:
+        _watcher = FileWatcher(sourceFiles, sourcesChanged, interval)
+        _watcher.start()
 
 class AppWrapperMiddleware:
     """
     Some hosted environments, e.g. pythonanywhere.com, require you
     to export the Bottle app object. Exporting an instance of this
     wrapper class makes sure the build procedure runs on startup.
+
+    The first request starts the build in the background; see
+    startBuild(). Nothing waits for it. After that, requests pay one
+    clock read: sources are checked again at most every recheck seconds
+    (never, if recheck is None) or on the next request after rebuild()
+    is called.
     """
-    def __init__(self, app):
+    def __init__(self, app, recheck=None):
       self.app = app
+      self.recheck = recheck
+      self._next_check = 0.0 ## monotonic time of the next build check
+      self._lock = threading.Lock()
+    def rebuild(self):
+      """ Check the sources and rebuild as needed on the next request. """
+      self._next_check = 0.0
     def __call__(self, e, h):
-      doBuild()
+      if time.monotonic() >= self._next_check:
+          self._checkBuild()
       return self.app(e,h)
+    def _checkBuild(self):
+      with self._lock:
+          now = time.monotonic()
+          if now < self._next_check:
+              return ## another thread just did it
+          startBuild()
+          startTicker()
+          if self.recheck is None:
+              self._next_check = float('inf')
+          else:
+              self._next_check = now + self.recheck
+
+## The app as served: counting and timing each request, see metrics.py.
+wsgiapp = MetricsMiddleware(app, _metrics)
 
 ##################################################
 ## Import this from external wsgi file
-app_for_wsgi_env = AppWrapperMiddleware(app)
+app_for_wsgi_env = AppWrapperMiddleware(wsgiapp)
 ##################################################
 
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """ wsgiref server that handles each request in its own thread. """
+    daemon_threads = True
+
 ########################################################
 ## Default wrapper  so we can spawn this app  commandline or
 ## from multiprocessing.
 ########################################################
-def serve(server='wsgiref', port=8800, reloader=False, debugmode=False):
+def serve(server='wsgiref', port=8800, reloader=False, debugmode=False,
+          engine='auto', tick=0.5, workers=1, production=False,
+          prerender=False, statefile=None, metrics=True, quiet=False):
     """
-    Build the html and js files, if needed, then launch the app.
+    Launch the app, building the html and js files, if needed, in the
+    background while it serves. See startBuild().
 
     The default server is the single-threaded 'wsgiref' server that comes with
     Python. It's fine for a demo, but for production you'll want to use
     something better, e.g. server='cherrypy'. For an extensive list of server
     options, see http://bottlepy.org/docs/dev/deployment.html
+
+    server='asyncio' uses the single event loop server in aioserve.py, which
+    handles thousands of open /stream connections without a thread each.
+
+    The engine arg selects the state engine used by stategen(), see
+    stateengine.py. tick is the number of seconds between state updates.
+
+    reloader=True watches the sources and rebuilds in process when they
+    change, see watchSources(). A change to a module the server runs
+    restarts the process, see sourcesChanged(). Bottle's own reloader,
+    which restarts the process on any change and so loses the state, is
+    not used.
+
+    production=True builds and serves the minified client bundle, see
+    useProfile().
+
+    prerender=True serves the home page with the readouts and the current
+    state already in it, see sendPrerendered().
+
+    statefile is the path of a file to keep the state and its history in
+    and to resume from on the next start, see useStateFile().
+
+    metrics=False stops recording request, tick and build timings, leaving
+    a single flag check per request, and /metrics answers 404.
+
+    quiet=True stops the server logging each request to stderr.
+
+    With workers > 1, this process only runs the state engine and forks
+    that many serving processes, which read the state from shared memory.
+    See mpserve.py. Only 'wsgiref' and 'asyncio' are supported as the
+    workers' server, and the reloader is not available in that mode.
     """
+    global state_engine, tick_interval, serve_prerendered
+    state_engine = engine
+    tick_interval = tick
+    serve_prerendered = prerender
+    _metrics.enabled = metrics
     bottle.debug(debugmode)
+    useProfile('production' if production else 'dev')
 
-    ## Client side tracks _state['server_start_time']
-    ## to decide if it should reload.
+    ## Part of every state ETag, so clients never mistake the state of an
+    ## earlier run for the current one. A resumed state is the same state,
+    ## so it keeps the start time of the run that began it.
     _state['server_start_time'] = time.time()
+    if statefile is not None:
+        useStateFile(statefile)
+        _state['server_start_time'] = _statefile.start_time
+
+    if workers > 1:
+        ## Forked workers get a copy of the assets as they are at fork
+        ## time, so build first.
+        import mpserve
+        _build.runNow()
+        _assets.preload()
+        mpserve.serveWorkers(sys.modules[__name__], workers, server,
+                             host='0.0.0.0', port=port, quiet=quiet)
+        return
+
+    startBuild()
+    startTicker()
+    if reloader:
+        watchSources()
 
-    ## rebuild as needed
-    doBuild()
+    ## The stock wsgiref server handles one request at a time, which
+    ## a single /stream subscriber would block forever. Give it threads.
+    ## The asyncio server handles /stream natively on its event loop.
+    options = {}
+    if server == 'wsgiref':
+        options['server_class'] = ThreadingWSGIServer
+    elif server == 'asyncio':
+        import aioserve ## registers 'asyncio' with Bottle
+        options['streams'] = {'/stream': _broadcaster}
 
     ## Launch the web service loop.
-    bottle.run(app,
+    bottle.run(wsgiapp,
                host='0.0.0.0',
                server=server,
                port=port,
-               reloader=reloader,
-               debug=debugmode)
+               debug=debugmode,
+               quiet=quiet,
+               **options)
 
 ###################################################
 ## The following runs only when we start from
@@ -235,16 +1250,38 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
               description = "Nearly Pure Python Web App Demo")
     parser.add_argument('-s', '--server', type=str, default='wsgiref',
-                        help="server program to use.")
+                        help="server program to use, e.g. asyncio (see aioserve.py).")
     parser.add_argument('-p', '--port', type=int, default=8800,
                         help="port number to serve on.")
     parser.add_argument('--no-reloader', dest='reloader', action='store_false',
-                        help="disable reloader (defult: enabled)")
+                        help="disable rebuilding on source changes (defult: enabled)")
     parser.add_argument('--no-debug', dest='debug', action='store_false',
                         help="disable debug mode (defult: enabled)")
+    parser.add_argument('-e', '--engine', type=str, default='auto',
+                        choices=('auto', 'list', 'array'),
+                        help="state engine, 'array' needs numpy (default: auto)")
+    parser.add_argument('-t', '--tick', type=float, default=0.5,
+                        help="seconds between state updates (default: 0.5)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="serving processes sharing one state engine, "
+                             "implies --no-reloader (default: 1)")
+    parser.add_argument('--production', action='store_true',
+                        help="build and serve the minified client bundle")
+    parser.add_argument('--prerender', action='store_true',
+                        help="serve the home page with the readouts rendered")
+    parser.add_argument('--state-file', dest='statefile',
+                        help="keep the state and its history in this file "
+                             "and resume from it on restart (needs numpy)")
+    parser.add_argument('--no-metrics', dest='metrics', action='store_false',
+                        help="don't record timings for /metrics (default: record)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="don't log each request")
     parser.set_defaults(reloader=True)
     parser.set_defaults(debug=True)
     args = parser.parse_args()
     serve(server=args.server, port=args.port,
-          reloader=args.reloader, debugmode=args.debug)
+          reloader=args.reloader, debugmode=args.debug, engine=args.engine,
+          tick=args.tick, workers=args.workers, production=args.production,
+          prerender=args.prerender, statefile=args.statefile,
+          metrics=args.metrics, quiet=args.quiet)
 
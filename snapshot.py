@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Immutable, pre-encoded snapshots of the server state.
+
+The server makes one Snapshot per state version (tick or step size change).
+It holds the state serialized to compact JSON bytes exactly once, plus gzip
+and, if the brotli package is installed, brotli compressed copies. Request
+handlers only pick a buffer and write it; no handler ever calls json.dumps
+on the full state. Snapshots are never modified, so publishing a new one is
+a single reference assignment.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import json
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+## Encodings precomputed for every snapshot, in order of preference.
+## Payloads shorter than min_compress bytes are only kept as plain JSON.
+encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+min_compress = 1024
+
+def encodeJSON(obj):
+    """ Compact JSON as UTF-8 bytes. """
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def acceptedEncodings(header):
+    """
+    Return the set of content codings an Accept-Encoding header allows,
+    ignoring any with q=0.
+    """
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.lower())
+    return accepted
+
+def compressVariants(data, level=None):
+    """
+    Return {coding: compressed bytes} for each of the encodings, or {} if
+    data is shorter than min_compress. level None means fast settings for
+    per-tick data; 'max' means best compression for data built once.
+    """
+    variants = {}
+    if len(data) < min_compress:
+        return variants
+    for coding in encodings:
+        if coding == 'br':
+            quality = 11 if level == 'max' else 5
+            variants[coding] = brotli.compress(data, quality=quality)
+        else:
+            compresslevel = 9 if level == 'max' else 6
+            variants[coding] = gzip.compress(data, compresslevel=compresslevel)
+    return variants
+
+def chooseBody(data, variants, accept_encoding):
+    """
+    Return (bytes, coding) for a request with the given Accept-Encoding
+    header, preferring the variants in encodings order. coding is None for
+    the uncompressed data.
+    """
+    if variants:
+        accepted = acceptedEncodings(accept_encoding)
+        for coding in encodings:
+            if coding in accepted and coding in variants:
+                return variants[coding], coding
+    return data, None
+
+class Snapshot:
+    """
+    One encoded state version. count and etag identify it, json is the
+    plain body and variants maps a content coding to the compressed body.
+    """
+    __slots__ = ('count', 'etag', 'json', 'variants')
+
+    def __init__(self, state, etag):
+        self.count = state.get('count', 0)
+        self.etag = etag
+        self.json = encodeJSON(state)
+        self.variants = compressVariants(self.json)
+
+    @classmethod
+    def fromEncoded(cls, count, etag, json, variants):
+        """
+        Make a Snapshot from already encoded parts, e.g. copied out of
+        shared memory, without serializing or compressing anything.
+        """
+        snap = cls.__new__(cls)
+        snap.count = count
+        snap.etag = etag
+        snap.json = json
+        snap.variants = variants
+        return snap
+
+    def body(self, accept_encoding):
+        """
+        Return (bytes, coding) for a request with the given Accept-Encoding
+        header. coding is None for plain JSON.
+        """
+        return chooseBody(self.json, self.variants, accept_encoding)
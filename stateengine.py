@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Description: State engines that drive the server side random walk.
+
+Each engine holds the current value of every state item and advances all of
+them by one step per tick. ListEngine is the original pure Python
+implementation. ArrayEngine keeps the values in a single numpy float array and
+does the step, clamp and round as batched vector operations, so the cost of a
+tick stays small even with hundreds of thousands of items.
+
+numpy is optional. makeEngine('auto', ...) falls back to ListEngine when it
+isn't installed.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import random
+import collections
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## Readouts are clamped to this range.
+VMIN = 0.0
+VMAX = 10.0
+
+class ListEngine:
+    """
+    Values live in a Python list and are walked one at a time with
+    random.choice. Fine for the demo's 10 items, linear and slow in Python
+    beyond a few thousand.
+    """
+    def __init__(self, nitems, stepsize):
+        self.nitems = nitems
+        self.stepsize = stepsize
+        self.values = [round(random.random()*10, 2) for n in range(nitems)]
+
+    def step(self):
+        """
+        Walk every value by -stepsize, 0 or +stepsize.
+        Returns: list of the indices whose value changed.
+        """
+        step = (-self.stepsize, 0.0, self.stepsize)
+        prior = self.values
+        values = [round(v + random.choice(step), 2) for v in prior]
+        self.values = [min(VMAX, max(VMIN, v)) for v in values]
+        return [i for i, (a, b) in enumerate(zip(prior, self.values)) if a != b]
+
+    def tolist(self):
+        """ Return the current values as a list of Python floats. """
+        return self.values
+
+class ArrayEngine:
+    """
+    Values live in one float64 numpy array. A tick draws all step directions
+    at once as small ints, then scales, adds, rounds and clamps in place, so no
+    per-item Python code runs.
+
+    values, if given, is a float64 array of nitems to walk in place from
+    the values it holds, e.g. one mapped from a file by persist.py.
+    """
+    def __init__(self, nitems, stepsize, seed=None, values=None):
+        if numpy is None:
+            raise ImportError("ArrayEngine requires numpy")
+        self.nitems = nitems
+        self.stepsize = stepsize
+        self.rng = numpy.random.default_rng(seed)
+        if values is None:
+            values = numpy.round(self.rng.random(nitems) * 10, 2)
+        self.values = values
+        ## Scratch buffers so ticks don't allocate.
+        self._delta = numpy.empty(nitems, dtype=numpy.float64)
+        self._prior = numpy.empty(nitems, dtype=numpy.float64)
+
+    def step(self):
+        """
+        Walk every value by -stepsize, 0 or +stepsize.
+        Returns: int array of the indices whose value changed.
+        """
+        numpy.copyto(self._prior, self.values)
+        directions = self.rng.integers(-1, 2, size=self.nitems, dtype=numpy.int8)
+        numpy.multiply(directions, self.stepsize, out=self._delta)
+        numpy.add(self.values, self._delta, out=self.values)
+        numpy.round(self.values, 2, out=self.values)
+        numpy.clip(self.values, VMIN, VMAX, out=self.values)
+        return numpy.flatnonzero(self.values != self._prior)
+
+    def tolist(self):
+        """ Return the current values as a list of Python floats. """
+        return self.values.tolist()
+
+class ChangeRing:
+    """
+    Bounded record of which items changed on each of the last depth ticks,
+    as returned by an engine's step(). Lets the server answer "what changed
+    since tick n" without keeping old values around.
+    """
+    def __init__(self, depth=120):
+        self.ticks = collections.deque(maxlen=depth)
+
+    def record(self, count, indices):
+        """ Remember the indices changed by tick number count. """
+        self.ticks.append((count, indices))
+
+    def changedSince(self, since, count):
+        """
+        Return a sorted list of indices changed after tick since, up to and
+        including tick count, or None if since is not covered by the ring
+        (too old, or from the future, e.g. after a server restart).
+        """
+        if since > count or not self.ticks:
+            return None
+        if since == count:
+            return []
+        if self.ticks[0][0] > since + 1:
+            return None
+        sets = [indices for n, indices in self.ticks if since < n <= count]
+        if not sets:
+            return []
+        if numpy is not None and isinstance(sets[0], numpy.ndarray):
+            if len(sets) == 1:
+                return sets[0].tolist()
+            return numpy.unique(numpy.concatenate(sets)).tolist()
+        return sorted(set().union(*sets))
+
+def makeEngine(kind, nitems, stepsize):
+    """
+    Return a state engine of the requested kind: 'list', 'array' or 'auto'.
+    'auto' picks ArrayEngine when numpy is importable.
+    Raises: ValueError for an unknown kind,
+            ImportError for 'array' without numpy.
+    """
+    if kind == 'auto':
+        kind = 'list' if numpy is None else 'array'
+    if kind == 'list':
+        return ListEngine(nitems, stepsize)
+    elif kind == 'array':
+        return ArrayEngine(nitems, stepsize)
+    raise ValueError("Unknown state engine: {}".format(kind))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Subscription scoped views of the state.
+
+A wall display showing items 200-249 of 100k has no use for the rest. A
+client names the items it wants, by index, with a compact key set such as
+'0-99,250' (see parseKeys()), either directly as /getstate?keys=... or
+through the id /subscribe returns for it. Different ways of writing the
+same set are reduced to one canonical form, and all clients of a canonical
+set share one View of the state: the projection of the state onto those
+items, encoded once per state version like a full Snapshot.
+
+Views registered through /subscribe, and those asked for since the last
+tick, are recomputed by refresh() right after each tick, outside the state
+lock, so a client polling every tick only picks an encoded buffer. Other
+views, e.g. the row ranges a scrolling virtual list passes through, are
+computed on demand by the request that needs them. At most maxviews views
+are kept, the least recently used being dropped first, and any not asked
+for within ttl seconds are dropped too. Each View also holds the delta
+since the previous tick, which is what a client polling every tick asks
+for. Views asked for in the binary format of wire.py keep Frames of the
+same, alongside or instead.
+
+A subscription id is the canonical key set itself, url-safe base64
+encoded, so every server process can decode it and nothing needs to be
+stored per client.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import time
+import base64
+import binascii
+import threading
+from collections import OrderedDict
+
+from snapshot import Snapshot
+from wire import Frame, schemaId
+
+## State fields sent along with the items of every view.
+metakeys = ('count', 'stepsize', 'server_start_time', 'client_version')
+
+def parseKeys(spec, nkeys):
+    """
+    Parse a key set, comma separated item indices and inclusive ranges
+    such as '0-99,250', into a sorted list of the indices below nkeys.
+    Returns None if spec is malformed.
+    """
+    indices = set()
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            return None
+        if first < 0 or last < first:
+            return None
+        indices.update(range(first, min(last, nkeys - 1) + 1))
+    return sorted(indices)
+
+def formatKeys(indices):
+    """ The canonical key set for a sorted list of indices. """
+    parts = []
+    n = 0
+    while n < len(indices):
+        first = last = indices[n]
+        n += 1
+        while n < len(indices) and indices[n] == last + 1:
+            last = indices[n]
+            n += 1
+        parts.append(str(first) if first == last else "{}-{}".format(first, last))
+    return ','.join(parts)
+
+def subscriptionId(canonical):
+    """ The subscription id for a canonical key set. """
+    encoded = base64.urlsafe_b64encode(canonical.encode('ascii'))
+    return encoded.rstrip(b'=').decode('ascii')
+
+def keysOfId(sid):
+    """ The key set a subscription id stands for, or None if it is invalid. """
+    try:
+        packed = (sid + '=' * (-len(sid) % 4)).encode('ascii')
+        return base64.b64decode(packed, altchars=b'-_', validate=True).decode('ascii')
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+
+def project(values, statekeys, indices):
+    """ The items of state dict values at indices, plus the metakeys. """
+    subset = {statekeys[i]:values[statekeys[i]] for i in indices}
+    for name in metakeys:
+        if name in values:
+            subset[name] = values[name]
+    return subset
+
+class View:
+    """
+    One key set's projection of the state. current is (etag, full, delta)
+    for the latest version computed, or None: full is a Snapshot of the
+    projection, delta, if not None, a Snapshot of just the items that
+    changed on the last tick, marked with delta_since. frames is the same
+    with wire.Frames for full and delta. subscribed is True for views
+    registered through /subscribe, wanted while the view has been asked
+    for since the last refresh().
+    """
+    __slots__ = ('indices', 'current', 'frames', 'used', 'subscribed',
+                 'wanted')
+
+    def __init__(self, indices):
+        self.indices = indices
+        self.current = None
+        self.frames = None
+        self.used = time.monotonic()
+        self.subscribed = False
+        self.wanted = False
+
+class Projections:
+    """
+    The Views of one state, keyed by canonical key set, least recently
+    used first. Beyond maxviews the least recently used are dropped, and
+    refresh() drops those not asked for within ttl seconds.
+    """
+    def __init__(self, statekeys, ttl=30.0, maxviews=256):
+        self.statekeys = statekeys
+        self.schema = schemaId(statekeys)
+        self.ttl = ttl
+        self.maxviews = maxviews
+        self.views = OrderedDict()
+        self._parsed = {} ## key set as sent -> (canonical, indices)
+        self._lock = threading.Lock()
+
+    def lookup(self, keys=None, sid=None):
+        """
+        Return (canonical, indices) for a key set given as keys or as a
+        subscription id, or None if it is malformed or selects nothing.
+        """
+        spec = keys if sid is None else keysOfId(sid)
+        if spec is None:
+            return None
+        found = self._parsed.get(spec)
+        if found is None:
+            indices = parseKeys(spec, len(self.statekeys))
+            if not indices:
+                return None
+            found = (formatKeys(indices), indices)
+            if len(self._parsed) >= 4096:
+                self._parsed.clear()
+            self._parsed[spec] = found
+        return found
+
+    def register(self, canonical, indices, subscribe=False):
+        """
+        Return the View of canonical, creating it if need be. With
+        subscribe, refresh() keeps it up to date from now on.
+        """
+        with self._lock:
+            view = self.views.get(canonical)
+            if view is None:
+                view = self.views[canonical] = View(indices)
+                while len(self.views) > self.maxviews:
+                    self.views.popitem(last=False)
+            else:
+                self.views.move_to_end(canonical)
+            view.subscribed = view.subscribed or subscribe
+        view.used = time.monotonic()
+        return view
+
+    def encoded(self, canonical, indices, etag, values, changed=None,
+                binary=False):
+        """
+        Return (full, delta) as in View for the state values at version
+        etag, computing them unless an earlier call or refresh() already
+        has. changed lists the indices the last tick changed, if known;
+        without it delta is None. With binary, full and delta are Frames.
+        """
+        view = self.register(canonical, indices)
+        view.wanted = True
+        current = view.frames if binary else view.current
+        if current is None or current[0] != etag:
+            current = self._compute(view, etag, values, changed, binary)
+        return current[1:]
+
+    def pending(self):
+        """ True if refresh() has any view to bring up to date. """
+        with self._lock:
+            return any(view.subscribed or view.wanted
+                       for view in self.views.values())
+
+    def refresh(self, etag, values, changed=None):
+        """
+        Bring the subscribed Views and those asked for since the last call
+        up to state version etag, and drop the Views not used within ttl
+        seconds. Call once per tick, not holding the state lock; values
+        must not change during the call.
+        """
+        expired = time.monotonic() - self.ttl
+        with self._lock:
+            for canonical, view in list(self.views.items()):
+                if view.used < expired:
+                    del self.views[canonical]
+            views = [view for view in self.views.values()
+                     if view.subscribed or view.wanted]
+            for view in views:
+                view.wanted = False
+        for view in views:
+            ## Only in the formats the view has been asked for in.
+            for binary, current in ((False, view.current), (True, view.frames)):
+                if current is not None and current[0] != etag:
+                    self._compute(view, etag, values, changed, binary)
+
+    def _compute(self, view, etag, values, changed, binary=False):
+        count = values.get('count', 0)
+        if changed is not None:
+            changed = set(changed)
+            changed = [i for i in view.indices if i in changed]
+        if binary:
+            full = Frame(values, etag, self.statekeys, self.schema, view.indices)
+            delta = None
+            if changed is not None:
+                delta = Frame(values, etag, self.statekeys, self.schema,
+                              changed, since=count - 1)
+            view.frames = (etag, full, delta)
+            return view.frames
+        full = Snapshot(project(values, self.statekeys, view.indices), etag)
+        delta = None
+        if changed is not None:
+            subset = project(values, self.statekeys, changed)
+            subset['delta_since'] = count - 1
+            delta = Snapshot(subset, etag)
+        view.current = (etag, full, delta)
+        return view.current
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Fixed-rate background ticker.
+
+Calls a function every interval seconds from a daemon thread. Deadlines are
+computed from the start time, not from the end of the previous call, so the
+rate doesn't drift with the cost of each tick. If a tick overruns, the
+missed deadlines are skipped rather than run back to back.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import sys
+import time
+import threading
+from traceback import format_exc
+
+class Ticker(threading.Thread):
+    """
+    Daemon thread calling fn() every interval seconds until stop().
+    Exceptions from fn are printed to stderr and the ticker keeps going.
+    observe, if given, is called after each call as observe(late, seconds,
+    missed): how far past its deadline the call started, how long it took
+    and how many deadlines were skipped before it.
+    """
+    def __init__(self, interval, fn, name='ticker', observe=None):
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.fn = fn
+        self.observe = observe
+        ## Number of calls made and of deadlines skipped due to overruns.
+        self.ticks = 0
+        self.skipped = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            missed = 0
+            if delay < 0:
+                missed = int(-delay // self.interval) + 1
+                self.skipped += missed
+                deadline += missed * self.interval
+                delay = deadline - time.monotonic()
+            if self._halt.wait(max(delay, 0)):
+                return
+            started = time.monotonic()
+            try:
+                self.fn()
+            except Exception:
+                print(format_exc(), file=sys.stderr)
+            self.ticks += 1
+            if self.observe is not None:
+                self.observe(started - deadline, time.monotonic() - started,
+                             missed)
+
+    def stop(self):
+        """ Ask the thread to exit. Does not wait for it. """
+        self._halt.set()
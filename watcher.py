@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Description: In-process source file watcher.
+
+Bottle's reloader restarts the whole server process on any source change,
+which throws away the state and the open connections. A FileWatcher thread
+instead reports which of a set of files changed, and the server rebuilds
+just what depends on them while it goes on serving. Only a change to a
+module the server itself runs restarts it.
+
+On Linux the thread sleeps on inotify watches of the directories holding
+the files. Elsewhere, or if inotify can't be set up, it polls every
+interval seconds. Either way, a change is a change of (mtime, size), so
+both backends report the same thing, and a burst of events from one editor
+save is reported once.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import os
+import sys
+import time
+import select
+import threading
+from traceback import format_exc
+
+from assets import fileStat
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                        use_errno=True)
+    _libc.inotify_init1
+    _libc.inotify_add_watch
+except (OSError, AttributeError):
+    _libc = None
+
+## inotify(7) flags and the events that can mean a file's contents changed.
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MASK = (0x2     ## IN_MODIFY
+         | 0x4     ## IN_ATTRIB
+         | 0x8     ## IN_CLOSE_WRITE
+         | 0x40    ## IN_MOVED_FROM
+         | 0x80    ## IN_MOVED_TO
+         | 0x100   ## IN_CREATE
+         | 0x200)  ## IN_DELETE
+
+class FileWatcher(threading.Thread):
+    """
+    Daemon thread calling onchange(paths) with the set of files, among
+    those returned by files(), that were modified, replaced or deleted.
+    files() is called again on every check, so the watched set may change,
+    e.g. when a module gains an import. If it raises, the previous set is
+    kept. Exceptions from onchange are printed to stderr.
+    """
+    def __init__(self, files, onchange, interval=1.0, settle=0.1):
+        super().__init__(name='filewatcher', daemon=True)
+        self.files = files
+        self.onchange = onchange
+        self.interval = interval
+        ## Seconds to wait after an inotify event for the rest of a save.
+        self.settle = settle
+        self.backend = 'poll'
+        self._stats = {}
+        self._fd = None
+        self._watched = set() ## directories with an inotify watch
+        self._halt = threading.Event()
+
+    def scan(self):
+        """
+        Return the paths whose (mtime, size) changed since the last scan.
+        Files new to the watched set don't count as changed.
+        """
+        try:
+            paths = set(self.files())
+        except Exception:
+            paths = set(self._stats)
+        stats = {path:fileStat(path) for path in paths}
+        changed = {path for path, stat in stats.items()
+                   if self._stats.get(path, stat) != stat}
+        self._stats = stats
+        return changed
+
+    def _startInotify(self):
+        if _libc is None:
+            return
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd >= 0:
+            self._fd = fd
+            self.backend = 'inotify'
+
+    def _watchDirs(self):
+        """ Add an inotify watch for each directory not watched yet. """
+        if self._fd is None:
+            return
+        for path in self._stats:
+            directory = os.path.dirname(path) or '.'
+            if directory not in self._watched:
+                wd = _libc.inotify_add_watch(self._fd,
+                                             os.fsencode(directory), IN_MASK)
+                if wd >= 0:
+                    self._watched.add(directory)
+
+    def _drain(self):
+        """ Discard pending inotify events; scan() works out what changed. """
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _wait(self):
+        """
+        Sleep until something may have changed. Returns False if nothing
+        can have, i.e. inotify reported no event within interval.
+        """
+        if self._fd is None:
+            self._halt.wait(self.interval)
+            return True
+        if not select.select([self._fd], [], [], self.interval)[0]:
+            return False
+        time.sleep(self.settle)
+        self._drain()
+        return True
+
+    def run(self):
+        self._startInotify()
+        self.scan()
+        self._watchDirs()
+        while not self._halt.is_set():
+            if not self._wait():
+                continue
+            changed = self.scan()
+            if not changed:
+                continue
+            self._watchDirs()
+            try:
+                self.onchange(changed)
+            except Exception:
+                print(format_exc(), file=sys.stderr)
+        if self._fd is not None:
+            os.close(self._fd)
+
+    def stop(self):
+        """ Ask the thread to exit. It does so within interval seconds. """
+        self._halt.set()
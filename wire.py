@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Compact binary encoding of the state.
+
+With many items, /getstate JSON is mostly repeated "itemNNN": keys and
+decimal text for values that stategen() has already rounded to hundredths.
+A client that sends Accept: application/x-nppwad-state gets a Frame
+instead:
+
+    offset  type         field
+         0  uint32       count
+         4  uint32       schema, schemaId() of the state keys
+         8  uint32       flags, RANGES or BITMAP, | DELTA
+        12  uint32       since, the tick a DELTA frame is relative to
+        16  uint32       nvalues
+        20  uint32       nranges, or with BITMAP the bitmap's byte length
+        24  float64      server_start_time
+        32  float64      stepsize
+        40  char[16]     client_version, ASCII, zero padded
+        56  uint32[2*nranges]  with RANGES, (first index, length) of each
+                         run of items
+         or uint8[nranges]  with BITMAP, bit i%8 of byte i//8 set for each
+                         item i, padded to a multiple of 4 bytes
+            int16[nvalues]  the values in hundredths, for the items in the
+                         ranges or bitmap in order, or otherwise for every
+                         key of the schema in order
+
+A key set, e.g. a scrolled list's rows, is mostly a few runs, while the
+items one tick changes are scattered, so frames take whichever of the two
+is smaller.
+
+All numbers are little endian, which is what typed arrays use on every
+platform a browser runs on, so the client reads the arrays in place. The
+keys themselves are sent once, by /schema, and a client that sees a frame
+with a schema id other than the one it has fetches the schema again.
+
+Values must lie within +-327.67, which the 0 to 10 readouts do.
+
+This file is part of NearlyPurePythonWebAppDemo
+https://github.com/Michael-F-Ellis/NearlyPurePythonWebAppDemo
+
+Author: Mike Ellis
+Copyright 2017 Ellis & Grant, Inc.
+License: MIT License
+"""
+import sys
+import zlib
+import array
+import struct
+
+import common
+from snapshot import compressVariants, chooseBody
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CONTENT_TYPE = common.wire_type
+SCALE = 100
+HEADER = struct.Struct('<6I2d16s')
+
+## Frame flags
+RANGES = 1
+DELTA = 2
+BITMAP = 4
+
+def schemaId(statekeys):
+    """ 32 bit id of a list of state keys. """
+    return zlib.crc32('\n'.join(statekeys).encode('utf-8'))
+
+def schema(statekeys):
+    """ The /schema response for statekeys. """
+    return dict(schema=schemaId(statekeys), keys=list(statekeys), scale=SCALE,
+                header=HEADER.size)
+
+def accepts(accept):
+    """ True if an Accept header asks for frames. """
+    return CONTENT_TYPE in (accept or '')
+
+def runs(indices):
+    """ (first, length) of each run of consecutive numbers in sorted indices. """
+    found = []
+    for i in indices:
+        if found and found[-1][0] + found[-1][1] == i:
+            found[-1][1] += 1
+        else:
+            found.append([i, 1])
+    return found
+
+def packArray(typecode, values):
+    """ Pack ints into little endian bytes of an array typecode. """
+    packed = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+def bitmap(indices, nkeys):
+    """ BITMAP bytes for sorted indices below nkeys. """
+    size = (nkeys + 31) // 32 * 4
+    if numpy is not None:
+        bits = numpy.zeros(size * 8, numpy.uint8)
+        bits[numpy.asarray(indices, numpy.int64)] = 1
+        return numpy.packbits(bits, bitorder='little').tobytes()
+    packed = bytearray(size)
+    for i in indices:
+        packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+def packValues(values, keys):
+    """ Pack the values at keys of state dict values as int16 hundredths. """
+    if numpy is not None:
+        floats = numpy.fromiter((values[k] for k in keys), numpy.float64, len(keys))
+        return numpy.rint(floats * SCALE).astype('<i2').tobytes()
+    return packArray('h', [int(round(values[k] * SCALE)) for k in keys])
+
+class Frame:
+    """
+    One state version, or part of one, encoded as above. Like
+    snapshot.Snapshot, count and etag identify it, data is the plain body
+    and variants maps a content coding to the compressed body.
+    """
+    __slots__ = ('count', 'etag', 'data', 'variants')
+
+    def __init__(self, values, etag, statekeys, schema, indices=None,
+                 since=None):
+        """
+        Encode the items of state dict values at indices, all of statekeys
+        if None, and the state fields in the header. schema is
+        schemaId(statekeys). With since, the frame is a DELTA relative to
+        that tick.
+        """
+        self.count = values.get('count', 0)
+        self.etag = etag
+        flags = 0 if since is None else DELTA
+        if indices is None or len(indices) == len(statekeys):
+            keys = statekeys
+            ranges = b''
+            nranges = 0
+        else:
+            keys = [statekeys[i] for i in indices]
+            found = runs(indices)
+            if 8 * len(found) <= (len(statekeys) + 31) // 32 * 4:
+                ranges = packArray('I', [n for run in found for n in run])
+                nranges = len(found)
+                flags |= RANGES
+            else:
+                ranges = bitmap(indices, len(statekeys))
+                nranges = len(ranges)
+                flags |= BITMAP
+        header = HEADER.pack(self.count, schema, flags,
+                             since or 0, len(keys), nranges,
+                             values.get('server_start_time', 0),
+                             values.get('stepsize', 0),
+                             values.get('client_version', '').encode('ascii'))
+        self.data = header + ranges + packValues(values, keys)
+        self.variants = compressVariants(self.data)
+
+    def body(self, accept_encoding):
+        """ Return (bytes, coding) as for snapshot.Snapshot.body(). """
+        return chooseBody(self.data, self.variants, accept_encoding)